@@ -10,17 +10,17 @@
   @url         https://github.com/DFRobor/DFRobot_LTR390UV
 '''
 
-import serial
 import time
-import smbus
-import os
-import math
-import RPi.GPIO as GPIO
-import math
 
-import modbus_tk
-import modbus_tk.defines as cst
-from modbus_tk import modbus_rtu
+try:
+  # Only needed for the UART interface, so the I2C driver also loads on machines without them
+  import serial
+  import modbus_tk.defines as cst
+  from modbus_tk import modbus_rtu
+except ImportError:
+  serial = None
+
+from drivers.i2c_bus import I2CBus, get_bus
 
 I2C_MODE                  = 0x01
 UART_MODE                 = 0x02
@@ -52,6 +52,8 @@ LTR390UV_HOLDINGREG_ALS_UVS_MEAS_RATE           =0x0D   #Resolution and sampling
 LTR390UV_HOLDINGREG_MAIN_CTRL                   =0x0E   #Sensor mode select
 a_gain = [1,3,6,9,18]
 a_int = [4.,2.,1.,0.5,0.25,0.25]
+a_rate_ms = [25,50,100,200,500,1000,2000,2000]   #Measurement rate bits 0-2
+a_conv_ms = [400,200,100,50,25,12.5,12.5,12.5]   #Conversion time by resolution bits 4-6
 
 
 eGain1 = 0 #Gain of 1
@@ -81,8 +83,17 @@ class DFRobot_LTR390UV():
     self.mode = 0
     self.resolution = 0
     self.gain = 0
+    self.meas_rate = 0x22         #Power-on default: 18 bit, 100ms
+    self._conversions_from = time.monotonic()
+    self._last_conversion = 0
+    self._last_raw = None
+    self.gain_range = 1           #Power-on default: gain of 3
+    self._schedule = None
+    self._schedule_index = 0
+    self._cache = {}
     if mode == I2C_MODE:
-      self.i2cbus = smbus.SMBus(bus)
+      # Shared bus manager (drivers/i2c_bus.py) instead of a private smbus handle
+      self.i2cbus = bus if isinstance(bus, I2CBus) else get_bus(bus)
       self._uart_i2c = I2C_MODE
     else:
       self.master = modbus_rtu.RtuMaster(serial.Serial(port="/dev/ttyAMA0",baudrate=baud, bytesize=8, parity='N', stopbits=1))
@@ -119,6 +130,7 @@ class DFRobot_LTR390UV():
     else:
       buffer = [mode]
     self._write_reg(LTR390UV_HOLDINGREG_MAIN_CTRL,buffer) 
+    self._restart_conversions()
   
   def set_ALS_or_UVS_meas_rate(self,bit,time):#self,bit,time
     '''
@@ -146,12 +158,14 @@ class DFRobot_LTR390UV():
       @param data Control data
     '''
     self.gain = bit+time
+    self.meas_rate = bit+time
     self.resolution = (self.gain&0xf0)>>4
     if self._uart_i2c == I2C_MODE:
       buffer=[self.gain,0]
     else:
       buffer = [self.gain]
     self._write_reg(LTR390UV_HOLDINGREG_ALS_UVS_MEAS_RATE,buffer) 
+    self._restart_conversions()
   def set_ALS_or_UVS_gain(self,data):
     '''
       @brief Set sensor gain
@@ -170,6 +184,7 @@ class DFRobot_LTR390UV():
       @param data Control data 
     '''
     self.gain = data
+    self.gain_range = data
     if self._uart_i2c == I2C_MODE:
       buffer=[data,0]
     else:
@@ -197,6 +212,125 @@ class DFRobot_LTR390UV():
         data = buffer[0]|buffer[1]<<16
     return data
   
+  def conversion_period(self):
+    '''!
+      @brief Time between two finished conversions for the configured resolution and measurement rate
+      @n The sensor measures at the measurement rate, but never faster than a conversion takes
+      @return Period in seconds
+    '''
+    rate_ms = a_rate_ms[self.meas_rate&0x07]
+    conv_ms = a_conv_ms[(self.meas_rate&0x70)>>4]
+    return max(rate_ms, conv_ms)/1000.0
+
+  def _restart_conversions(self):
+    '''!
+      @brief The sensor starts converting again after a mode or rate change
+    '''
+    self._conversions_from = time.monotonic()
+    self._last_conversion = 0
+    self._last_raw = None
+
+  def read_all_data(self):
+    '''!
+      @brief Read the ALS and UVS data registers in one burst
+      @return (ALS raw data, UVS raw data)
+    '''
+    if self._uart_i2c == I2C_MODE:
+      buffer = self._read_reg(LTR390UV_INPUTREG_ALS_DATA_LOW,8,0)
+      als = buffer[0]|buffer[1]<<8|buffer[2]<<16|buffer[3]<<24
+      uvs = buffer[4]|buffer[5]<<8|buffer[6]<<16|buffer[7]<<24
+    else:
+      buffer = self._read_reg(LTR390UV_INPUTREG_ALS_DATA_LOW,4)
+      als = buffer[0]|buffer[1]<<16
+      uvs = buffer[2]|buffer[3]<<16
+    return als,uvs
+
+  def read_sample(self):
+    '''!
+      @brief Read the data of the current mode and whether it comes from a new conversion
+      @n The module exposes no data-ready flag, so a sample is fresh when a conversion period has
+      @n passed since the last fresh one (timed from the last mode or rate change), or when the
+      @n value changed, which also re-aligns the timing to the sensor's own clock
+      @return (raw data, True if fresh)
+    '''
+    als,uvs = self.read_all_data()
+    data = als if self.mode == ALSMode else uvs
+    now = time.monotonic()
+    period = self.conversion_period()
+    conversion = int((now - self._conversions_from)/period)   #Conversions finished since the restart
+    if self._last_raw is not None and data != self._last_raw and conversion <= self._last_conversion:
+      # The sensor finished a conversion earlier than we counted: follow its clock
+      self._conversions_from = now - (self._last_conversion + 1)*period
+      conversion = self._last_conversion + 1
+    fresh = conversion > self._last_conversion
+    if fresh:
+      self._last_conversion = conversion
+    self._last_raw = data
+    return data,fresh
+
+  def wait_for_next_conversion(self):
+    '''!
+      @brief Sleep until a conversion not yet read has finished, then read it
+      @n Returns at once if one already finished since the last fresh sample
+      @return Raw data of that conversion
+    '''
+    time.sleep(max(0.0, self.next_conversion_time() - time.monotonic()))
+    data,fresh = self.read_sample()
+    return data
+
+  def next_conversion_time(self):
+    '''!
+      @brief When the next conversion not yet read finishes
+      @return time.monotonic() value, in the past if one is already waiting
+    '''
+    return self._conversions_from + (self._last_conversion + 1)*self.conversion_period()
+
+  def begin_alternating(self, uvs_per_als = 1):
+    '''!
+      @brief Interleave UVS and ALS conversions, switching mode only when a conversion has finished
+      @n Call update_alternating() at least once per conversion period (see conversion_period()),
+      @n read the results with read_cached()
+      @param uvs_per_als UVS conversions between two ALS conversions
+    '''
+    self._schedule = [UVSMode]*uvs_per_als + [ALSMode]
+    self._schedule_index = 0
+    self._cache = {}
+    self.set_mode(self._schedule[0])
+
+  def update_alternating(self):
+    '''!
+      @brief Cache the current mode's conversion if a new one finished, then move to the next mode
+      @return Mode of the new conversion (ALSMode or UVSMode), or None if there was none
+    '''
+    data,fresh = self.read_sample()
+    if not fresh:
+      return None
+    mode = self.mode
+    self._cache[mode] = (data,time.monotonic())
+    self._schedule_index = (self._schedule_index + 1)%len(self._schedule)
+    if self._schedule[self._schedule_index] != mode:
+      self.set_mode(self._schedule[self._schedule_index])
+    return mode
+
+  def read_cached(self):
+    '''!
+      @brief Last cached value of each channel with its age, without touching the sensor
+      @return Dict with 'uvs' (raw data), 'als' (raw data), 'lux' (from the ALS data) and
+      @n 'uvs_age'/'als_age' in seconds; channels not converted yet are left out
+    '''
+    now = time.monotonic()
+    result = {}
+    if UVSMode in self._cache:
+      data,at = self._cache[UVSMode]
+      result['uvs'] = data
+      result['uvs_age'] = now - at
+    if ALSMode in self._cache:
+      data,at = self._cache[ALSMode]
+      result['als'] = data
+      result['lux'] = (0.6*data)/(a_gain[self.gain_range]*a_int[self.resolution])
+      result['als_age'] = now - at
+    return result
+
   def read_ALSTrans_form_data(self):
     if self._uart_i2c == I2C_MODE:
       if self.mode == ALSMode:
@@ -218,6 +352,10 @@ class DFRobot_LTR390UV_I2C(DFRobot_LTR390UV):
     @brief An example of an i2c interface module
   '''
   def __init__(self ,bus ,addr):
+    '''!
+      @param bus I2C bus number or drivers.i2c_bus.I2CBus instance
+      @param addr I2C address of the module
+    '''
     self._addr = addr
     DFRobot_LTR390UV.__init__(self,bus,0,I2C_MODE)   
     
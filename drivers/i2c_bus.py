@@ -0,0 +1,197 @@
+# drivers/i2c_bus.py
+#
+# One manager per physical I2C bus, shared by every sensor driver. It owns the
+# only file handle on /dev/i2c-N (Adafruit_PureIO, the same layer Blinka's
+# busio uses on Linux), so the Adafruit drivers and the DFRobot LTR390 driver
+# no longer run two independent stacks on the same wires.
+#
+#   register access   read_i2c_block_data / write_i2c_block_data, the smbus
+#                     calls the DFRobot drivers make
+#   busio access      BusIO(bus) is a drop-in busio.I2C for the Adafruit
+#                     drivers (BME680, BH1750)
+#
+# Every transfer holds the bus lock, and transaction() holds it across several
+# transfers so a burst of register reads runs back to back. The lock is
+# reentrant, so a driver call inside a transaction() on the same thread does
+# not deadlock. Transfers and errors are counted per device address.
+
+import threading
+from contextlib import contextmanager
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(number=1):
+    """
+    Returns the shared manager of an I2C bus, creating it on first use.
+
+    Args:
+        number: Bus number (/dev/i2c-<number>).
+
+    Returns:
+        I2CBus instance; every call with the same number returns the same one.
+    """
+    with _buses_lock:
+        if number not in _buses:
+            _buses[number] = I2CBus(number)
+        return _buses[number]
+
+
+class I2CBus:
+    def __init__(self, number=1, smbus=None):
+        """
+        Serialises all traffic on one I2C bus. Use get_bus() rather than
+        creating instances, so every driver shares the same one.
+
+        :param number: Bus number (/dev/i2c-<number>).
+        :param smbus: SMBus-like handle to use instead of opening the device file, e.g. an
+            emulated bus or a recorder from drivers/i2c_emulation.py.
+        """
+        self.number = number
+        self.lock = threading.RLock()
+        self.device_stats = {}  # address -> {'transfers', 'errors', 'last_error'}
+        self.smbus = smbus
+
+    def open(self):
+        # The device file is opened on first use, so importing drivers needs no hardware
+        with self.lock:
+            if self.smbus is None:
+                from Adafruit_PureIO.smbus import SMBus
+                self.smbus = SMBus(self.number)
+            return self.smbus
+
+    def close(self):
+        with self.lock:
+            if self.smbus is not None:
+                self.smbus.close()
+                self.smbus = None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Holds the bus for several transfers, e.g. status and data registers
+        read back to back with no other device's traffic in between.
+        """
+        with self.lock:
+            yield self
+
+    def _transfer(self, address, call, *args):
+        # Runs one smbus call under the lock and counts it against the device
+        with self.lock:
+            stats = self.device_stats.setdefault(address, {'transfers': 0, 'errors': 0, 'last_error': None})
+            stats['transfers'] += 1
+            try:
+                return call(*args)
+            except OSError as e:
+                stats['errors'] += 1
+                stats['last_error'] = str(e)
+                raise
+
+    def read_i2c_block_data(self, address, register, length):
+        """
+        Reads consecutive registers, as smbus.SMBus.read_i2c_block_data.
+
+        Args:
+            address: 7-bit device address.
+            register: First register, or bytes written before a repeated start.
+            length: Number of bytes to read.
+
+        Returns:
+            List of byte values.
+        """
+        return list(self._transfer(address, self.open().read_i2c_block_data, address, register, length))
+
+    def write_i2c_block_data(self, address, register, data):
+        """
+        Writes consecutive registers, as smbus.SMBus.write_i2c_block_data.
+
+        Args:
+            address: 7-bit device address.
+            register: First register.
+            data: Byte values to write.
+        """
+        return self._transfer(address, self.open().write_i2c_block_data, address, register, data)
+
+    def write_bytes(self, address, data):
+        # Plain write without a register byte
+        return self._transfer(address, self.open().write_bytes, address, bytes(data))
+
+    def read_bytes(self, address, length):
+        # Plain read without a register byte
+        return self._transfer(address, self.open().read_bytes, address, length)
+
+    def probe(self, address):
+        # True if a device acknowledges; not counted, so scans do not show up as errors
+        with self.lock:
+            try:
+                self.open().read_byte(address)
+            except OSError:
+                return False
+            return True
+
+    def stats(self):
+        """
+        Returns transfer and error counts per device.
+
+        Returns:
+            Dict of hex address (e.g. '0x1c') -> transfers, errors and last_error.
+        """
+        with self.lock:
+            return {f"0x{address:02x}": dict(stats) for address, stats in sorted(self.device_stats.items())}
+
+
+class BusIO:
+    def __init__(self, bus):
+        """
+        busio.I2C interface on top of an I2CBus, for the Adafruit drivers.
+
+        adafruit_bus_device locks with try_lock() around each write/read pair;
+        here that takes the bus lock, so their transfers cannot interleave with
+        any other driver's.
+
+        :param bus: I2CBus instance, normally from get_bus().
+        """
+        self.bus = bus
+
+    def try_lock(self):
+        return self.bus.lock.acquire(blocking=False)
+
+    def unlock(self):
+        self.bus.lock.release()
+
+    def scan(self):
+        return [address for address in range(0x08, 0x78) if self.bus.probe(address)]
+
+    def writeto(self, address, buffer, *, start=0, end=None, stop=True):
+        if end is None:
+            end = len(buffer)
+        self.bus.write_bytes(address, buffer[start:end])
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None, stop=True):
+        if end is None:
+            end = len(buffer)
+        data = self.bus.read_bytes(address, end - start)
+        buffer[start:end] = data
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None, stop=False):
+        if out_end is None:
+            out_end = len(buffer_out)
+        if in_end is None:
+            in_end = len(buffer_in)
+        if stop:
+            self.writeto(address, buffer_out, start=out_start, end=out_end)
+            self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+        else:
+            # Register write and read in one combined transfer (repeated start)
+            data = self.bus.read_i2c_block_data(address, bytes(buffer_out[out_start:out_end]), in_end - in_start)
+            buffer_in[in_start:in_end] = bytes(data)
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -0,0 +1,283 @@
+# drivers/i2c_emulation.py
+#
+# Stand-ins for the I2C bus, for testing and benchmarking drivers on a plain
+# Linux machine. Each one is an SMBus-like handle for I2CBus(smbus=...):
+#
+#   FakeSMBus       Routes transfers to emulated devices by address; absent
+#                   addresses fail like real ones (EREMOTEIO). Optionally
+#                   sleeps for the time the transfer takes at a bus speed.
+#   FakeLTR390      Register map of the DFRobot LTR390 UV module: identity
+#                   registers, gain, resolution and measurement rate,
+#                   ALS/UVS mode, and data registers that only change when
+#                   a conversion finishes. Counts follow the datasheet
+#                   formulas for a given lux and UV index.
+#   RecordingSMBus  Wraps a real handle and records every transfer (arguments,
+#                   result or error, timing) to replay later.
+#   ReplaySMBus     Plays a recording back: each request gets the response
+#                   the real device gave at the same point in the run, or,
+#                   strictly, the driver must repeat the recorded transfers.
+#
+#   bus = I2CBus(1, smbus=FakeSMBus({0x1C: FakeLTR390(lux=300, uv_index=2)}))
+#   sensor = DFRobot_LTR390UV_I2C(bus, 0x1C)
+
+import bisect
+import errno
+import json
+import random
+import time
+
+# LTR390 datasheet: integration time factor by resolution (20 bit = 4x the
+# 18 bit / 100 ms reference) and UV sensitivity at gain 18, 20 bit
+LTR390_GAINS = [1, 3, 6, 9, 18]
+LTR390_INT_FACTORS = [4.0, 2.0, 1.0, 0.5, 0.25, 0.125]
+LTR390_BITS = [20, 19, 18, 17, 16, 13]
+LTR390_RATES_MS = [25, 50, 100, 200, 500, 1000, 2000, 2000]
+LTR390_CONVERSION_MS = [400, 200, 100, 50, 25, 12.5]
+LTR390_UV_SENSITIVITY = 2300  # Counts per UV index at gain 18, 20 bit
+
+
+class FakeLTR390:
+    # Input registers (16 bit, read at their index)
+    PID, VID, ADDR, BAUDRATE, STOPBIT, VERSION, PART_ID = range(7)
+    ALS_DATA, UVS_DATA = 0x07, 0x09  # Low word, high word follows
+    # Holding registers (16 bit, written at index + 5)
+    GAIN, MEAS_RATE, MAIN_CTRL = 0x06, 0x0D, 0x0E
+    HOLDING_OFFSET = 5
+
+    def __init__(self, address=0x1C, lux=300.0, uv_index=2.0, noise=0.0, seed=0):
+        """
+        Emulated DFRobot LTR390 module.
+
+        :param address: Address reported in the ADDR register.
+        :param lux: Ambient light in lux, or a callable of seconds since creation.
+        :param uv_index: UV index, or a callable of seconds since creation.
+        :param noise: Relative standard deviation of the counts (0 for exact values).
+        :param seed: Noise seed.
+        """
+        self.input = {self.VID: 0x3343, self.ADDR: address, self.BAUDRATE: 3, self.VERSION: 0x0100, self.PART_ID: 0xB2}
+        self.holding = {self.GAIN: 1, self.MEAS_RATE: 0x22, self.MAIN_CTRL: 0x0A}  # Gain 3, 18 bit / 100 ms, UVS
+        self.lux = lux
+        self.uv_index = uv_index
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.created = time.monotonic()
+        self.conversions_from = self.created
+        self.converted = 0   # Conversions finished since the last restart
+        self.conversions = 0  # Conversions finished in total
+
+    def period(self):
+        rate = self.holding[self.MEAS_RATE]
+        return max(LTR390_RATES_MS[rate & 0x07], LTR390_CONVERSION_MS[min((rate & 0x70) >> 4, 5)]) / 1000.0
+
+    def counts(self, at):
+        # Raw counts of a conversion finished at the given time, for the current mode and settings
+        gain = LTR390_GAINS[min(self.holding[self.GAIN], 4)]
+        resolution = min((self.holding[self.MEAS_RATE] & 0x70) >> 4, 5)
+        elapsed = at - self.created
+        if self.holding[self.MAIN_CTRL] & 0x08:
+            uv_index = self.uv_index(elapsed) if callable(self.uv_index) else self.uv_index
+            value = uv_index * LTR390_UV_SENSITIVITY * gain / 18 * LTR390_INT_FACTORS[resolution] / 4
+        else:
+            lux = self.lux(elapsed) if callable(self.lux) else self.lux
+            value = lux * gain * LTR390_INT_FACTORS[resolution] / 0.6
+        if self.noise:
+            value *= 1 + self.rng.gauss(0, self.noise)
+        return min(max(0, int(round(value))), (1 << LTR390_BITS[resolution]) - 1)
+
+    def update(self):
+        # Publishes the latest finished conversion to the current mode's data registers
+        if not self.holding[self.MAIN_CTRL] & 0x02:
+            return  # Standby
+        period = self.period()
+        finished = int((time.monotonic() - self.conversions_from) / period)
+        if finished > self.converted:
+            self.conversions += finished - self.converted
+            self.converted = finished
+            value = self.counts(self.conversions_from + finished * period)
+            register = self.UVS_DATA if self.holding[self.MAIN_CTRL] & 0x08 else self.ALS_DATA
+            self.input[register] = value & 0xFFFF
+            self.input[register + 1] = value >> 16
+
+    def read(self, register, length):
+        self.update()
+        data = []
+        for index in range(register, register + (length + 1) // 2):
+            word = self.input.get(index, 0)
+            data += [word & 0xFF, word >> 8]
+        return data[:length]
+
+    def write(self, register, data):
+        self.update()
+        index = register - self.HOLDING_OFFSET
+        self.holding[index] = data[0] | (data[1] << 8 if len(data) > 1 else 0)
+        if index in (self.MEAS_RATE, self.MAIN_CTRL):
+            # A new mode or rate starts converting from scratch
+            self.conversions_from = time.monotonic()
+            self.converted = 0
+
+
+class FakeSMBus:
+    def __init__(self, devices, bus_speed=None):
+        """
+        SMBus-like handle backed by emulated devices.
+
+        :param devices: Dict of address -> device with read(register, length) and write(register, data).
+        :param bus_speed: Bus clock in Hz; each transfer then sleeps as long as it would take on the
+            wire (9 clocks per byte plus start, address and stop). None transfers instantly.
+        """
+        self.devices = devices
+        self.bus_speed = bus_speed
+        self.pointers = {}  # Address -> register selected by the last plain write
+        self.transfers = 0
+
+    def _device(self, address, length):
+        self.transfers += 1
+        if self.bus_speed:
+            time.sleep((length + 2) * 9 / self.bus_speed)
+        if address not in self.devices:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return self.devices[address]
+
+    def read_i2c_block_data(self, address, register, length=32):
+        if not isinstance(register, int):
+            register = register[0]  # Combined write-then-read from BusIO
+        return self._device(address, length + 1).read(register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        self._device(address, len(data) + 1).write(register, list(data))
+
+    def write_bytes(self, address, data):
+        device = self._device(address, len(data))
+        if data:
+            self.pointers[address] = data[0]
+            if len(data) > 1:
+                device.write(data[0], list(data[1:]))
+
+    def read_bytes(self, address, length):
+        return bytes(self._device(address, length).read(self.pointers.get(address, 0), length))
+
+    def read_byte(self, address):
+        return self.read_bytes(address, 1)[0]
+
+    def close(self):
+        pass
+
+
+def _jsonable(value):
+    if isinstance(value, (bytes, bytearray)):
+        return list(value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+class RecordingSMBus:
+    OPS = ('read_i2c_block_data', 'write_i2c_block_data', 'read_bytes', 'write_bytes', 'read_byte')
+
+    def __init__(self, smbus):
+        """
+        Records every transfer made through an SMBus-like handle, e.g. the real bus on the Pi:
+        bus = get_bus(1); bus.smbus = RecordingSMBus(bus.open()).
+
+        :param smbus: Handle that performs the transfers.
+        """
+        self.smbus = smbus
+        self.records = []
+        self.started = time.monotonic()
+
+    def _call(self, op, address, *args):
+        record = {'t': time.monotonic() - self.started, 'op': op, 'address': address, 'args': _jsonable(args)}
+        try:
+            result = getattr(self.smbus, op)(address, *args)
+        except OSError as e:
+            record['error'] = [e.errno, e.strerror]
+            raise
+        else:
+            record['result'] = _jsonable(result)
+            return result
+        finally:
+            record['duration'] = time.monotonic() - self.started - record['t']
+            self.records.append(record)
+
+    def __getattr__(self, op):
+        if op not in self.OPS:
+            raise AttributeError(op)
+        return lambda address, *args: self._call(op, address, *args)
+
+    def save(self, path):
+        """
+        Writes the recording as JSON lines, one transfer per line.
+        """
+        with open(path, 'w') as f:
+            for record in self.records:
+                f.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.smbus.close()
+
+
+class ReplaySMBus:
+    def __init__(self, path, strict=False, pace=True):
+        """
+        Replays a RecordingSMBus recording.
+
+        By default each transfer gets the response recorded for the same request most recently
+        before the same point in the run (or the first one), so the data registers change when
+        they changed on the real bus, whatever the driver's access pattern. With strict, the
+        driver must make exactly the recorded transfers in order.
+
+        :param path: JSON lines file written by RecordingSMBus.save().
+        :param strict: Fail on any transfer that differs from the next recorded one.
+        :param pace: Take as long as the recorded transfer did (strict: also wait for its start time).
+        """
+        with open(path) as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+        self.strict = strict
+        self.pace = pace
+        self.position = 0
+        self.by_request = {}  # (op, address, args) -> records in time order
+        for record in self.records:
+            self.by_request.setdefault(self._key(record['op'], record['address'], record['args']), []).append(record)
+        self.started = time.monotonic()
+
+    def _key(self, op, address, args):
+        return op, address, json.dumps(args)
+
+    def _next_record(self, op, address, args):
+        # The recorded transfer that answers this one
+        if self.strict:
+            if self.position >= len(self.records):
+                raise ValueError(f"Replay exhausted after {len(self.records)} transfers")
+            record = self.records[self.position]
+            if (record['op'], record['address'], record['args']) != (op, address, args):
+                raise ValueError(
+                    f"Replay diverged at transfer {self.position}: recorded {record['op']}({record['address']:#04x}, "
+                    f"{record['args']}), got {op}({address:#04x}, {args})"
+                )
+            self.position += 1
+            if self.pace:
+                time.sleep(max(0.0, self.started + record['t'] - time.monotonic()))
+            return record
+        candidates = self.by_request.get(self._key(op, address, args))
+        if not candidates:
+            raise ValueError(f"No recorded transfer {op}({address:#04x}, {args})")
+        elapsed = time.monotonic() - self.started
+        index = bisect.bisect_right([record['t'] for record in candidates], elapsed)
+        return candidates[max(0, index - 1)]
+
+    def _call(self, op, address, *args):
+        record = self._next_record(op, address, _jsonable(args))
+        if self.pace:
+            time.sleep(record['duration'])
+        if 'error' in record:
+            raise OSError(*record['error'])
+        result = record['result']
+        return bytes(result) if op == 'read_bytes' else result
+
+    def __getattr__(self, op):
+        if op not in RecordingSMBus.OPS:
+            raise AttributeError(op)
+        return lambda address, *args: self._call(op, address, *args)
+
+    def close(self):
+        pass
@@ -0,0 +1,70 @@
+# drivers/ltr390_async.py
+#
+# asyncio facade for the DFRobot LTR390 driver. Waiting for a conversion is an
+# asyncio.sleep() until the driver's next_conversion_time(), so the event loop
+# keeps serving other work during the integration time; only the short bus
+# transfers run in a one-thread executor, which also keeps the (not thread
+# safe) driver to one caller at a time.
+#
+#   sensor = AsyncLTR390(DFRobot_LTR390UV_I2C(1, 0x1C))
+#   uv = await sensor.read()
+#   async for uv in sensor.stream(5):
+#       ...
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncLTR390:
+    def __init__(self, sensor, executor=None):
+        """
+        Non-blocking access to a configured LTR390 driver.
+
+        :param sensor: DFRobot_LTR390UV instance, already begun and set to a mode.
+        :param executor: Executor for the bus transfers (defaults to a private one-thread executor).
+        """
+        self.sensor = sensor
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="ltr390")
+        self._own_executor = executor is None
+
+    async def call(self, method, *args):
+        """
+        Runs a blocking driver method in the executor, e.g. await call('set_mode', 0x0A).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, getattr(self.sensor, method), *args)
+
+    async def read(self):
+        """
+        Waits for the next conversion not yet read and returns it.
+
+        Returns:
+            Raw data of the current mode (see DFRobot_LTR390UV.read_sample).
+        """
+        while True:
+            await asyncio.sleep(max(0.0, self.sensor.next_conversion_time() - time.monotonic()))
+            data, fresh = await self.call('read_sample')
+            if fresh:
+                return data
+
+    async def stream(self, rate):
+        """
+        Yields new samples at up to rate per second, never faster than the sensor converts.
+
+        Args:
+            rate: Samples per second wanted.
+
+        Yields:
+            Raw data, one value per new conversion used.
+        """
+        next_at = time.monotonic()
+        while True:
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            yield await self.read()
+            # A slow consumer delays the next sample rather than causing a burst
+            next_at = max(next_at + 1.0 / rate, time.monotonic())
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
@@ -1,98 +1,264 @@
 import asyncio
 import websockets
 import json
-import sqlite3
 import time
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-from datetime import datetime
-import pytz
 import os
+import sys
+import signal
+
+# Add the parent directory to sys.path to import from utils
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.storage import DB_PATH, connect_reader, read_ingest_cursor, read_last_reading
+from utils.sinks import build_pipeline
+from utils.latency import LatencyRecorder
+from utils.ingest import LagTracker, parse_sample_time, POLICIES, POLICY_BATCH, POLICY_LATEST, POLICY_THROTTLE
+from utils.wire_format import FIELDS, FORMAT_BINARY, FORMAT_JSON, decode_frame
+
+# Storage sinks. Each enabled sink gets its own queue, worker thread, batching and retries
+# (see utils/sinks.py), so the slowest sink no longer sets the pace for the others.
+# Enable sinks with ACQUISITION_SINKS (comma separated) and override any option below
+# with a JSON file named by SINKS_CONFIG, e.g. {"parquet": {"directory": "/mnt/usb/parquet"}}.
+ENABLED_SINKS = os.getenv("ACQUISITION_SINKS", "sqlite,influx").split(",")
+SINK_CONFIG = {
+    "sqlite": {
+        "db_path": DB_PATH,
+        "batch_size": 30,            # Commit after this many readings
+        "flush_interval": 10.0,      # ...or once the oldest buffered reading is this many seconds old
+        "max_retries": 3,
+        "retry_backoff": 0.5,
+    },
+    "influx": {
+        "url": "http://localhost:8086",
+        "token": os.getenv("INFLUXDB_TOKEN"),
+        "org": "BTP Project",
+        "bucket": "Weather Data",
+        "max_queue": 10000,          # Points held while InfluxDB is slow; oldest are dropped beyond this
+        "batch_size": 100,           # Points per write call
+        "flush_interval": 5.0,       # Maximum seconds a point waits before being written
+        "max_retries": 2,            # Then the batch is spooled to disk and replayed later
+        "retry_backoff": 1.0,
+        "spool_dir": '/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/influx_spool',
+        "replay_batch": 5000,        # Line protocol lines per replay write
+        "replay_rate": 2000,         # Maximum replayed points per second
+    },
+    "parquet": {
+        "directory": '/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/parquet',
+        "batch_size": 600,
+        "flush_interval": 600.0,
+    },
+    "memory": {
+        "capacity": 3600,
+        "batch_size": 1,
+        "flush_interval": 1.0,
+    },
+}
+if os.getenv("SINKS_CONFIG"):
+    with open(os.getenv("SINKS_CONFIG")) as f:
+        for name, options in json.load(f).items():
+            SINK_CONFIG.setdefault(name, {}).update(options)
+STATS_INTERVAL = 60            # Seconds between stats reports
+LATENCY_METRICS_DIR = os.getenv("LATENCY_METRICS_DIR")  # Also write acquisition-latency.json here when set
+latency = LatencyRecorder()    # Receive and per-sink commit latency of every reading (see utils/latency.py)
 
-# SQLite setup (existing code)
-conn = sqlite3.connect('/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/weather_data.db')
-cursor = conn.cursor()
-
-# Create a table for storing data if it doesn't exist
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS weather_data (
-        Timestamp TEXT,
-        Temperature REAL,
-        Humidity REAL,
-        Pressure REAL,
-        AQI REAL,
-        UV_Data REAL,
-        Ambient_Light REAL
-    )
-''')
-conn.commit()
-
-# InfluxDB connection details
-token = os.getenv("INFLUXDB_TOKEN")
-org = "BTP Project"
-bucket = "Weather Data"
-url = "http://localhost:8086"
-
-# Initialize InfluxDB client
-client = InfluxDBClient(url=url, token=token, org=org)
-write_api = client.write_api(write_options=SYNCHRONOUS)
- 
 # WebSocket URL
-WEBSOCKET_URL = "ws://localhost:6789"
+WEBSOCKET_URL = os.getenv("SENSOR_WEBSOCKET_URL", "ws://localhost:6789")
+RECONNECT_MIN_DELAY = 1.0      # Seconds before the first reconnect attempt
+RECONNECT_MAX_DELAY = 60.0     # Backoff doubles up to this
+WIRE_FORMAT = os.getenv("SENSOR_WIRE_FORMAT", FORMAT_BINARY)  # Asked for at subscribe; servers without binary support send JSON
+LIVE_BATCH = int(os.getenv("SENSOR_LIVE_BATCH", "1"))        # Live samples per frame; more saves CPU but adds latency
+if WIRE_FORMAT not in (FORMAT_BINARY, FORMAT_JSON):
+    raise ValueError(f"SENSOR_WIRE_FORMAT must be {FORMAT_BINARY!r} or {FORMAT_JSON!r}, got {WIRE_FORMAT!r}")
 
-# Define your local timezone
-local_tz = pytz.timezone('Asia/Kolkata')  # Replace with your local timezone
+# Ingest loop: messages are processed as soon as they arrive. See utils/ingest.py for the policies.
+INGEST_QUEUE_SIZE = 1000       # Received messages waiting to be processed; recv pauses when full
+LAG_THRESHOLD = 5.0            # Seconds behind sample time at which the backpressure policy kicks in
+BACKPRESSURE_POLICY = os.getenv("BACKPRESSURE_POLICY", POLICY_BATCH)  # batch, latest or throttle
+BATCH_HARDER_FACTOR = 4        # 'batch' policy: multiply every sink's batch size and flush interval by this
+if BACKPRESSURE_POLICY not in POLICIES:
+    raise ValueError(f"BACKPRESSURE_POLICY must be one of {POLICIES}, got {BACKPRESSURE_POLICY!r}")
+lag_tracker = LagTracker(threshold=LAG_THRESHOLD)
 
-async def fetch_and_store_data():
+async def report_stats(pipeline):
+    # Periodically show ingest lag and per-sink queue depth, throughput and latency
+    previous = pipeline.stats()
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        lag = lag_tracker.stats()
+        print(
+            f"Ingest: lag {lag['last_lag_sec']:.2f}s (p50 {lag['p50_lag_sec']:.2f}s, p99 {lag['p99_lag_sec']:.2f}s, "
+            f"max {lag['max_lag_sec']:.2f}s), {lag['messages']} messages, {lag['dropped']} dropped, "
+            f"{'behind' if lag['behind'] else 'keeping up'}"
+        )
+        current = pipeline.stats()
+        for name, stats in current.items():
+            rate = (stats['written'] - previous[name]['written']) / STATS_INTERVAL
+            print(
+                f"Sink {name}: queue {stats['queue_depth']}/{stats['queue_capacity']}, {rate:.1f} rows/s, "
+                f"last batch {stats['last_batch_size']} in {stats['last_batch_latency_sec']:.3f}s "
+                f"(max {stats['max_batch_latency_sec']:.3f}s), written {stats['written']}, "
+                f"retries {stats['retries']}, saved {stats['saved']}, failed {stats['failed']}, dropped {stats['dropped']}"
+                + (f", spool backlog {stats['spool_backlog_bytes']} bytes, replayed {stats['points_replayed']}"
+                   if 'spool_backlog_bytes' in stats else "")
+            )
+        previous = current
+        print(f"Latency: {latency.format()}")
+        if LATENCY_METRICS_DIR:
+            latency.write_json(os.path.join(LATENCY_METRICS_DIR, "acquisition-latency.json"))
+
+async def receive_messages(websocket, queue):
+    # Read frames as they arrive; when the queue is full this waits, which pushes back on the socket
     try:
-        async with websockets.connect(WEBSOCKET_URL) as websocket:
-            while True:
-                message = await websocket.recv()
-                data = json.loads(message)
-
-                # Add timestamp if not present
-                data['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S")
-
-                # Insert the data into the SQLite database
-                cursor.execute('''
-                    INSERT INTO weather_data (Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    data['timestamp'],
-                    data['temperature'],
-                    data['humidity'],
-                    data['pressure'],
-                    data['AQI'],
-                    data['uv_data'],
-                    data['ambient_light']
-                ))
-                conn.commit()
-
-                # Get the current local time with timezone
-                local_time = datetime.now(local_tz)
-
-                # Prepare data point for InfluxDB
-                point = Point("environment") \
-                    .tag("location", "office") \
-                    .field("temperature", data['temperature']) \
-                    .field("humidity", data['humidity']) \
-                    .field("pressure", data['pressure']) \
-                    .field("gas_resistance", data['AQI']) \
-                    .field("uv_data", data['uv_data']) \
-                    .field("ambient_light", data['ambient_light']) \
-                    .time(local_time)
-
-                # Write data point to InfluxDB
-                write_api.write(bucket=bucket, org=org, record=point)
-
-                # Wait before fetching the next data point
-                await asyncio.sleep(1)  # Adjust delay as needed
-    except Exception as e:
-        print(f"Error fetching data: {e}")
+        async for message in websocket:
+            await queue.put(message)
+    except websockets.ConnectionClosedError as e:
+        print(f"WebSocket connection lost: {e}")
+    finally:
+        # Tell the consumer nothing more is coming. Never wait here: on cancel the consumer has
+        # already stopped reading, and a full queue would leave this task stuck for good
+        try:
+            queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+async def apply_backpressure(websocket, pipeline, state):
+    # Called when the lag tracker changes state ('behind' or 'recovered')
+    if BACKPRESSURE_POLICY == POLICY_BATCH:
+        pipeline.set_batch_factor(BATCH_HARDER_FACTOR if state == 'behind' else 1)
+    elif BACKPRESSURE_POLICY == POLICY_THROTTLE:
+        await websocket.send(json.dumps({"type": "slow_down" if state == 'behind' else "resume"}))
+    print(f"Ingest {state} (lag {lag_tracker.last_lag:.2f}s), policy: {BACKPRESSURE_POLICY}")
+
+def store_reading(pipeline, data, last_values):
+    # Complete the reading: a change-only frame from the sensor server (see SENSOR_CHANGE_ONLY
+    # in websocket_server.py) carries only the fields that moved, the rest keep their last value
+    for field in FIELDS:
+        if field in data:
+            last_values[field] = data[field]
+        else:
+            data[field] = last_values.get(field)
+
+    # Keep the server's sample time when it sends one, so catch-up readings are stored when
+    # they were taken; otherwise stamp the receive time (text for schema v1, epoch ms for v2)
+    if 'ts_ms' not in data:
+        data['ts_ms'] = int(time.time() * 1000)
+    data['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data['ts_ms'] / 1000))
+
+    # Hand the reading to every sink; none of them blocks the event loop
+    pipeline.put(data)
+
+def merge_fields(samples, last_values):
+    # Carries the fields of readings that are not stored (dropped by the 'latest' policy) into
+    # last_values, so change-only readings stored after them are completed with current values
+    for sample in samples:
+        for field in FIELDS:
+            if field in sample:
+                last_values[field] = sample[field]
+
+def decode_message(message):
+    # Binary frames arrive as bytes (see utils/wire_format.py), JSON frames as text; a JSON
+    # batch frame (catch-up after a reconnect) holds many readings, any other frame one
+    if isinstance(message, bytes):
+        return decode_frame(message)
+    data = json.loads(message)
+    if data.get('type') == 'batch':
+        return data['samples'], data.get('missed', 0)
+    return [data], 0
+
+async def consume(websocket, pipeline, cursor, last_values):
+    # Stores readings from one connection until it closes. cursor holds the sequence number and
+    # stream id of the last reading handed to the sinks, so a reconnect can resume after it;
+    # last_values holds that reading's fields.
+    queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    receiver = asyncio.create_task(receive_messages(websocket, queue))
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+
+            # Drop to latest: skip everything already queued behind this message
+            if BACKPRESSURE_POLICY == POLICY_LATEST and lag_tracker.behind:
+                while not queue.empty():
+                    newer = queue.get_nowait()
+                    if newer is None:
+                        queue.put_nowait(None)
+                        break
+                    merge_fields(decode_message(message)[0], last_values)
+                    message = newer
+                    lag_tracker.dropped += 1
+
+            samples, missed = decode_message(message)
+            for sample in samples:
+                latency.record_reading('receive', sample)
+            if missed:
+                # Change-only fields sent in the lost readings are unknown: ask for a full snapshot
+                print(f"Sensor server no longer had {missed} readings to replay")
+                await websocket.send(json.dumps({"type": "keyframe"}))
+            for sample in samples:
+                seq = sample.get('seq')
+                if seq is not None and sample.get('stream') == cursor['stream'] and seq <= cursor['seq']:
+                    continue  # Already stored before the reconnect
+                store_reading(pipeline, sample, last_values)
+                if seq is not None:
+                    cursor['seq'] = seq
+                    cursor['stream'] = sample.get('stream')
+
+            # Lag of the newest reading in the frame; a catch-up burst is judged by where it ends
+            if samples:
+                state = lag_tracker.record(parse_sample_time(samples[-1]))
+                if state is not None:
+                    await apply_backpressure(websocket, pipeline, state)
+    finally:
+        receiver.cancel()
+
+def load_committed_cursor():
+    # Start after the last reading the SQLite sink committed, so a restarted daemon
+    # neither loses the readings taken while it was down nor stores any twice.
+    # Returns the cursor and that reading's fields, which change-only frames build on.
+    if 'sqlite' not in ENABLED_SINKS:
+        return {'seq': 0, 'stream': None}, {}
+    conn = connect_reader(SINK_CONFIG['sqlite'].get('db_path', DB_PATH))
+    try:
+        stream, seq = read_ingest_cursor(conn)
+        last_values = read_last_reading(conn)
     finally:
-        # Close database connections
         conn.close()
-        client.close()
+    return {'seq': seq, 'stream': stream}, last_values
+
+async def fetch_and_store_data():
+    # SIGTERM (e.g. from systemd) cancels this task, so the finally below flushes the sinks.
+    # Raising from a plain signal handler instead can land outside any task while the event
+    # loop is polling and skip the flush.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    pipeline = build_pipeline(ENABLED_SINKS, SINK_CONFIG, latency)
+    stats_task = asyncio.create_task(report_stats(pipeline))
+    cursor, last_values = load_committed_cursor()
+    delay = RECONNECT_MIN_DELAY
+    try:
+        while True:
+            try:
+                async with websockets.connect(WEBSOCKET_URL) as websocket:
+                    # Ask the server to replay everything after the last reading we stored
+                    await websocket.send(json.dumps({
+                        "type": "subscribe",
+                        "after_seq": cursor['seq'],
+                        "stream": cursor['stream'],
+                        "format": WIRE_FORMAT,
+                        "batch": LIVE_BATCH,
+                    }))
+                    delay = RECONNECT_MIN_DELAY
+                    await consume(websocket, pipeline, cursor, last_values)
+            except Exception as e:
+                print(f"Error fetching data: {e}")
+            print(f"Reconnecting to {WEBSOCKET_URL} in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+    except asyncio.CancelledError:
+        print("Shutting down")
+    finally:
+        stats_task.cancel()
+        # Flush every sink's queued readings before exiting
+        pipeline.close()
 
 if __name__ == "__main__":
     asyncio.run(fetch_and_store_data())
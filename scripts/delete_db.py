@@ -1,11 +1,19 @@
-import sqlite3
+import os
+import sys
+
+# Add the parent directory to sys.path to import from utils
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.storage import DB_PATH, connect_writer, get_schema_version
 
 # Connect to the SQLite database
-conn = sqlite3.connect('/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/weather_data.db')
+conn = connect_writer(DB_PATH)
 cursor = conn.cursor()
 
-# Delete all rows from the table
-cursor.execute('DROP TABLE weather_data')
+# Delete all rows from the table (schema v2 keeps them in weather_readings behind the weather_data view)
+if get_schema_version(conn) >= 2:
+    cursor.execute('DELETE FROM weather_readings')
+else:
+    cursor.execute('DROP TABLE weather_data')
 conn.commit()
 
 # Close the database connection
@@ -0,0 +1,53 @@
+# scripts/migrate_db.py
+#
+# Migrates weather_data.db to the epoch-keyed schema (version 2).
+# Safe to run while data_acquisition.py is writing; an interrupted run
+# resumes where it stopped.
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+# Add the parent directory to sys.path to import from utils
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.storage import (
+    DB_PATH,
+    BUSY_TIMEOUT_MS,
+    MIGRATION_CHUNK_ROWS,
+    MIGRATION_PAUSE,
+    SCHEMA_VERSION,
+    get_schema_version,
+    migrate_to_v2,
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the weather database to the epoch-keyed schema")
+    parser.add_argument('--db', default=DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--chunk', type=int, default=MIGRATION_CHUNK_ROWS, help='Rows copied per transaction')
+    parser.add_argument('--pause', type=float, default=MIGRATION_PAUSE, help='Seconds to sleep between chunks')
+    parser.add_argument('--drop-old', action='store_true', help='Drop the old weather_data_v1 table afterwards')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+
+    version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        print(f"Database is already at schema version {version}.")
+        if args.drop_old:
+            conn.execute('DROP TABLE IF EXISTS weather_data_v1')
+            print("Dropped weather_data_v1.")
+        conn.close()
+        return
+
+    start_time = time.time()
+    copied = migrate_to_v2(conn, chunk_rows=args.chunk, pause=args.pause, drop_old=args.drop_old)
+    print(f"Migrated {copied} rows to schema version {SCHEMA_VERSION} in {time.time() - start_time:.1f}s")
+    if not args.drop_old:
+        print("The original rows are kept in weather_data_v1; rerun with --drop-old once you have checked the result.")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,23 @@
 # scripts/print_db.py
 
-import sqlite3
+import os
+import sys
 import pandas as pd
 
-def print_last_n_entries(db_path='/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/weather_data.db', n=20):
-    # Connect to the database
-    conn = sqlite3.connect(db_path)
+# Add the parent directory to sys.path to import from utils
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.storage import DB_PATH, connect_reader, get_schema_version
+
+def print_last_n_entries(db_path=DB_PATH, n=20):
+    # Connect to the database (read-only WAL reader, safe while acquisition is running)
+    conn = connect_reader(db_path)
     cursor = conn.cursor()
     
-    # Fetch the last n entries ordered by Timestamp
+    # Fetch the last n entries; from schema v2 on this walks the weather_readings_ts_ms index backwards
+    order_by = 'ts_ms' if get_schema_version(conn) >= 2 else 'Timestamp'
     cursor.execute(f'''
-        SELECT * FROM weather_data ORDER BY Timestamp DESC LIMIT {n}
+        SELECT Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light
+        FROM weather_data ORDER BY {order_by} DESC LIMIT {int(n)}
     ''')
     rows = cursor.fetchall()
     
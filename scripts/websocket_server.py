@@ -1,79 +1,370 @@
 import asyncio
 import websockets
 import json
+import threading
 import time
-import board
-import busio
-import adafruit_bme680
-import adafruit_bh1750
 import sys
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Add the parent directory to sys.path to import from drivers
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from drivers.DFRobot_LTR390UV import DFRobot_LTR390UV_I2C
-from drivers.ltr390_constants import *  # Import all constants
-
-# Initialize I2C bus
-i2c = busio.I2C(board.SCL, board.SDA)
-
-# Initialize BME680 (address 0x77) for temperature, humidity, pressure, AQI
-bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c, address=0x77)
-
-# Initialize LTR390 for UV sensing (address 0x1C)
-ltr390 = DFRobot_LTR390UV_I2C(1, 0x1C)
-
-# Begin sensor operation and check if initialization is successful
-if not ltr390.begin():
-    print("Failed to initialize LTR390UV sensor")
-else:
-    print("LTR390UV sensor initialized successfully")
-
-# Set the sensor to UVS mode (for UV detection)
-ltr390.set_mode(0x0A)  # UVS mode as per the library
-
-# Set measurement rate and gain for UV sensor
-ltr390.set_ALS_or_UVS_meas_rate(e18bit, e100ms)  # 18-bit resolution and 100ms sampling
-ltr390.set_ALS_or_UVS_gain(eGain3)  # Set gain to 3 (default)
-
-# Initialize BH1750 for ambient light sensing (address 0x23)
-bh1750 = adafruit_bh1750.BH1750(i2c, address=0x23)
-
-# Function to gather sensor data
-def get_sensor_data():
-    # BME680 sensor readings
-    temperature = bme680.temperature
-    humidity = bme680.humidity
-    pressure = bme680.pressure
-    gas = bme680.gas  # Air Quality Index (AQI)
-
-    # LTR390 sensor readings (UVS Data)
-    uvs_data = ltr390.read_original_data()
-
-    # BH1750 sensor readings (ambient light in lux)
-    ambient_light = bh1750.lux
-
-    # Prepare the data in JSON format
-    data = {
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "temperature": temperature,
-        "humidity": humidity,
-        "pressure": pressure,
-        "AQI": gas,
-        "uv_data": uvs_data,
-        "ambient_light": ambient_light  # Include ambient light data
-    }
-    return json.dumps(data)
+from utils.history import iter_history
+from utils.latency import LatencyRecorder
+from utils.ring_buffer import SampleRingBuffer
+from utils.sensor_backends import build_backend
+from utils.wire_format import FORMAT_BINARY, FORMAT_JSON, HEADER, encode_frame, encode_sample
+
+# Sensor backend (see utils/sensor_backends.py): 'i2c' for the station's sensors, 'simulated'
+# to run anywhere. Backend options can be set with a JSON file named by SENSOR_BACKEND_CONFIG,
+# e.g. {"rate": 50, "time_scale": 1440, "fault_rate": 0.01}.
+SENSOR_BACKEND = os.getenv("SENSOR_BACKEND", "i2c")
+SENSOR_BACKEND_CONFIG = {}
+if os.getenv("SENSOR_BACKEND_CONFIG"):
+    with open(os.getenv("SENSOR_BACKEND_CONFIG")) as f:
+        SENSOR_BACKEND_CONFIG = json.load(f)
+WEBSOCKET_PORT = int(os.getenv("SENSOR_WEBSOCKET_PORT", "6789"))
+
+# Sampling runs once for all clients on its own thread, so the blocking I2C reads never stall
+# the event loop. Channels are oversampled at their own rates (see utils/sensor_backends.py)
+# and decimated on each publish interval: a field's value is the mean of the reads taken in
+# the interval, and "summary" holds their min, max and count so short spikes survive the
+# decimation. A field with no read in the interval keeps its previous value and is left out
+# of the summary. A snapshot is complete when published and never modified afterwards. Recent
+# snapshots are kept with sequence numbers so a client that reconnects can resume where it
+# left off instead of losing readings.
+PUBLISH_INTERVAL = float(os.getenv("SENSOR_PUBLISH_INTERVAL", "1.0"))  # Seconds between published (decimated) snapshots
+REPLAY_BUFFER_SIZE = 3600    # Snapshots kept for resuming clients (one hour at 1 Hz)
+SUBSCRIBE_TIMEOUT = 1.0      # Seconds a new client has to send {"type": "subscribe"} before streaming live
+STREAM_ID = int(time.time())  # Identifies this server run; sequence numbers restart with it
+
+# Optional change-only publishing: a snapshot carries only the fields whose mean, min or max
+# moved more than their deadband since they were last sent, and nothing is published while
+# no field moves. Every KEYFRAME_INTERVAL seconds a full snapshot ("keyframe": true) goes
+# out regardless. Clients rebuild complete readings by carrying unchanged fields forward
+# (see store_reading in data_acquisition.py). A client that lost readings it cannot resume
+# (overwritten in the replay buffer) sends {"type": "keyframe"} and the next snapshot is a
+# full one, rather than its stored fields staying stale until the next scheduled keyframe.
+# Deadbands can be overridden with a JSON object in SENSOR_DEADBANDS, e.g. {"pressure": 0.2}.
+CHANGE_ONLY = os.getenv("SENSOR_CHANGE_ONLY", "0") == "1"
+KEYFRAME_INTERVAL = float(os.getenv("SENSOR_KEYFRAME_INTERVAL", "60"))  # Seconds between full snapshots
+DEADBANDS = {
+    "temperature": 0.05,     # °C
+    "humidity": 0.2,         # %RH
+    "pressure": 0.05,        # hPa
+    "AQI": 200.0,            # Ohms of gas resistance
+    "uv_data": 5.0,          # Raw UVS counts
+    "ambient_light": 2.0,    # Lux
+}
+DEADBANDS.update(json.loads(os.getenv("SENSOR_DEADBANDS", "{}")))
+keyframe_requested = threading.Event()  # Set by a client's keyframe request, cleared by the next keyframe
+
+# A published sample: the reading with its JSON and binary frames (see utils/wire_format.py),
+# each encoded once and sent as-is to every client that negotiated that format
+Snapshot = namedtuple('Snapshot', ['seq', 'data', 'frame', 'binary_frame'])
+
+replay_buffer = SampleRingBuffer(REPLAY_BUFFER_SIZE)
+new_sample = None  # asyncio.Condition, created in main()
+
+# Sample-to-send latency (see utils/latency.py), logged every STATS_INTERVAL seconds together
+# with the backend's I2C transfer and error counts, and also written to
+# LATENCY_METRICS_DIR/server-latency.json when that is set
+STATS_INTERVAL = 60
+LATENCY_METRICS_DIR = os.getenv("LATENCY_METRICS_DIR")
+latency = LatencyRecorder()
+
+async def notify_clients():
+    async with new_sample:
+        new_sample.notify_all()
+
+# Each sensor channel is read on its own period: fast channels are not held back by the
+# slow BME680 gas measurement, and the LTR390 is not polled faster than its 100 ms integration.
+# Channels on different devices that fall due together are read in parallel, so their
+# conversions overlap and a cycle costs about the longest one rather than the sum.
+def read_channels(channels):
+    # Reads one device's due channels in order; returns (fields, sample time) per successful read
+    results = []
+    for name, read in channels:
+        try:
+            values = read()
+        except Exception as e:
+            print(f"Error reading {name} sensor: {e}")
+            continue
+        results.append((values, int(time.time() * 1000)))
+    return results
+
+def read_due_channels(executor, due, window, sample_times):
+    # Starts every due device at once and adds the results to the publish interval's window;
+    # a failed read adds nothing
+    by_device = {}
+    for name, device, read in due:
+        by_device.setdefault(device, []).append((name, read))
+    futures = [executor.submit(read_channels, channels) for channels in by_device.values()]
+    wait(futures)
+    for future in futures:
+        for values, ts_ms in future.result():
+            for field, value in values.items():
+                sample_times[field] = ts_ms
+                if value is None:
+                    continue
+                if field not in window:
+                    window[field] = [0.0, value, value, 0]  # total, min, max, count
+                stats = window[field]
+                stats[0] += value
+                stats[1] = min(stats[1], value)
+                stats[2] = max(stats[2], value)
+                stats[3] += 1
+
+def changed_fields(latest, summary, published):
+    # Fields whose mean, min or max moved beyond their deadband since they were last sent
+    changed = []
+    for field, value in latest.items():
+        if field not in published:
+            changed.append(field)
+            continue
+        deadband = DEADBANDS.get(field, 0.0)
+        stats = summary.get(field, {})
+        candidates = [value, stats.get("min", value), stats.get("max", value)]
+        if any(abs(candidate - published[field]) > deadband for candidate in candidates):
+            changed.append(field)
+    return changed
+
+def publish_snapshot(loop, latest, window, sample_times, published):
+    # Decimates the window into latest (means) and a summary, then starts a new window.
+    # In change-only mode, published holds the values last sent and when the last keyframe went out.
+    summary = {}
+    for field, (total, minimum, maximum, count) in window.items():
+        latest[field] = total / count
+        summary[field] = {"min": minimum, "max": maximum, "count": count}
+    window.clear()
+    fields = list(latest)
+    keyframe = None
+    if CHANGE_ONLY:
+        keyframe = keyframe_requested.is_set() or time.monotonic() - published['keyframe_at'] >= KEYFRAME_INTERVAL
+        if keyframe:
+            keyframe_requested.clear()
+            published['keyframe_at'] = time.monotonic()
+        else:
+            fields = changed_fields(latest, summary, published['values'])
+            if not fields:
+                return  # Nothing moved: no frame, no sequence number
+        published['values'].update((field, latest[field]) for field in fields)
+    data = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+    data.update((field, latest[field]) for field in fields)
+    data["summary"] = {field: summary[field] for field in fields if field in summary}
+    data["sample_ts_ms"] = {field: sample_times[field] for field in fields if field in sample_times}  # When each field was last read
+    if keyframe is not None:
+        data["keyframe"] = keyframe
+    data["ts_ms"] = int(time.time() * 1000)
+    append_snapshot(loop, data)
+
+def append_snapshot(loop, data):
+    # Numbers, stamps, encodes and publishes a finished reading
+    data["mono_ns"] = time.monotonic_ns()  # High-resolution sample time for stage latencies
+    data["stream"] = STREAM_ID
+    # The sampler (or replay) thread is the buffer's only writer, so the next sequence number
+    # is known up front and the snapshot is complete before any handler can see it
+    data["seq"] = replay_buffer.last_seq + 1
+    binary_frame = encode_frame([encode_sample(data)])
+    replay_buffer.append(Snapshot(data["seq"], data, json.dumps(data), binary_frame))
+    asyncio.run_coroutine_threadsafe(notify_clients(), loop)
+
+def sample_loop(loop, stop_event, channels):
+    # Runs on the sampler thread; the event loop only hears about finished snapshots
+    latest = {}
+    window = {}
+    sample_times = {}
+    published = {'values': {}, 'keyframe_at': float('-inf')}
+    start = time.monotonic()
+    next_read = {name: start for name, _, _, _ in channels}
+    next_publish = start
+    executor = ThreadPoolExecutor(max_workers=len({device for _, device, _, _ in channels}))
+    while not stop_event.is_set():
+        now = time.monotonic()
+        due = [(name, device, read) for name, device, _, read in channels if now >= next_read[name]]
+        if due:
+            read_due_channels(executor, due, window, sample_times)
+            for name, _, period, _ in channels:
+                if now >= next_read[name]:
+                    # A read that overran its period delays the next one rather than causing a burst
+                    next_read[name] = max(next_read[name] + period, time.monotonic())
+        if time.monotonic() >= next_publish:
+            if latest or window:
+                publish_snapshot(loop, latest, window, sample_times, published)
+            next_publish = max(next_publish + PUBLISH_INTERVAL, time.monotonic())
+        stop_event.wait(max(0.0, min(min(next_read.values()), next_publish) - time.monotonic()))
+    executor.shutdown()
+
+# Historical replay: with SENSOR_REPLAY set to a database or export (see utils/history.py) the
+# server streams recorded readings instead of sampling, e.g. to load-test acquisition and the
+# dashboards with realistic values. SENSOR_REPLAY_SPEED is the speed-up over the recorded pace
+# (1 for real time, 60 for an hour a minute, 0 for as fast as the slowest client keeps up).
+# SENSOR_REPLAY_TIMESTAMPS is 'now' to stamp readings when they are sent (the original time is
+# kept in source_ts_ms) or 'original' to keep the recorded times. Either way readings carry the
+# mono_ns of when they were published, which the acquisition daemon measures its lag from.
+REPLAY_SOURCE = os.getenv("SENSOR_REPLAY")
+REPLAY_SPEED = float(os.getenv("SENSOR_REPLAY_SPEED", "1"))
+REPLAY_TIMESTAMPS = os.getenv("SENSOR_REPLAY_TIMESTAMPS", "now")
+if REPLAY_TIMESTAMPS not in ("now", "original"):
+    raise ValueError(f"SENSOR_REPLAY_TIMESTAMPS must be 'now' or 'original', got {REPLAY_TIMESTAMPS!r}")
+
+client_positions = {}  # Connection -> last sequence number sent to it
+
+def replay_loop(loop, stop_event, source):
+    # Runs on the sampler thread in place of sample_loop
+    replayed = 0
+    start = time.monotonic()
+    first_ts_ms = None
+    for data in iter_history(source):
+        if stop_event.is_set():
+            break
+        if first_ts_ms is None:
+            first_ts_ms = data["ts_ms"]
+        if REPLAY_SPEED > 0:
+            due = start + (data["ts_ms"] - first_ts_ms) / 1000 / REPLAY_SPEED
+            if stop_event.wait(max(0.0, due - time.monotonic())):
+                break
+        else:
+            # As fast as possible, but only once a client is connected and never lapping one
+            # in the replay buffer (the event loop updates client_positions, so work on a copy)
+            while True:
+                positions = list(client_positions.values())
+                if positions and replay_buffer.last_seq - min(positions) < REPLAY_BUFFER_SIZE // 2:
+                    break
+                if stop_event.wait(0.01):
+                    return
+        if REPLAY_TIMESTAMPS == "now":
+            data["source_ts_ms"] = data["ts_ms"]
+            data["ts_ms"] = int(time.time() * 1000)
+        data["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data["ts_ms"] / 1000))
+        append_snapshot(loop, data)
+        replayed += 1
+    print(f"Replay of {source} finished: {replayed} readings in {time.monotonic() - start:.1f}s")
+
+# Send interval per client; a lagging consumer may ask us to stretch it (see utils/ingest.py).
+# Readings buffered in the meantime go out together at the end of each interval.
+SEND_INTERVAL = 1.0        # Seconds between readings
+MAX_SEND_INTERVAL = 10.0   # Upper bound when a client asks us to slow down
+SLOW_DOWN_FACTOR = 2       # Interval multiplier per slow_down request
+
+async def handle_control_messages(websocket, state):
+    # Clients may send {"type": "slow_down"}, {"type": "resume"} or {"type": "keyframe"}
+    async for message in websocket:
+        try:
+            control = json.loads(message)
+        except ValueError:
+            continue
+        if control.get("type") == "slow_down":
+            state['interval'] = min(state['interval'] * SLOW_DOWN_FACTOR, MAX_SEND_INTERVAL)
+        elif control.get("type") == "resume":
+            state['interval'] = SEND_INTERVAL
+        elif control.get("type") == "keyframe":
+            keyframe_requested.set()
+
+MAX_CLIENT_BATCH = 60        # Upper bound on the live batch size a client may ask for
+
+async def wait_for_subscribe(websocket):
+    # Returns (after_seq, options). after_seq is the sequence number to resume after, or None for
+    # a client that just wants live data. {"type": "subscribe", "after_seq": N, "stream": S}
+    # resumes after N if S is this server run; a different (or missing) stream means everything
+    # buffered is new to the client. Optional "format" ("json" or "binary") picks the frame
+    # encoding and "batch" asks for live samples to be sent N at a time.
+    options = {'format': FORMAT_JSON, 'batch': 1}
+    try:
+        message = await asyncio.wait_for(websocket.recv(), SUBSCRIBE_TIMEOUT)
+        request = json.loads(message)
+    except (asyncio.TimeoutError, ValueError):
+        return None, options
+    if request.get("type") != "subscribe":
+        return None, options
+    if request.get("format") == FORMAT_BINARY:
+        options['format'] = FORMAT_BINARY
+    try:
+        options['batch'] = min(max(1, int(request.get("batch", 1))), MAX_CLIENT_BATCH)
+    except (TypeError, ValueError):
+        pass
+    if request.get("stream") == STREAM_ID and request.get("after_seq") is not None:
+        return int(request["after_seq"]), options
+    return 0, options
+
+async def send_samples(websocket, samples, missed=0, wire_format=FORMAT_JSON):
+    # One sample goes out as its shared frame; several go out as a single batch frame
+    # spliced together from the already encoded samples
+    if wire_format == FORMAT_BINARY:
+        if len(samples) == 1 and not missed:
+            await websocket.send(samples[0].binary_frame)
+        elif samples or missed:
+            await websocket.send(encode_frame([snapshot.binary_frame[HEADER.size:] for snapshot in samples], missed))
+    elif len(samples) == 1 and not missed:
+        await websocket.send(samples[0].frame)
+    elif samples or missed:
+        frames = ", ".join(snapshot.frame for snapshot in samples)
+        await websocket.send(f'{{"type": "batch", "samples": [{frames}], "missed": {missed}}}')
 
 # WebSocket handler
 async def sensor_data(websocket, path):
+    after_seq, options = await wait_for_subscribe(websocket)
+    if after_seq is None:
+        after_seq = replay_buffer.last_seq
+    client_positions[websocket] = after_seq
+    state = {'interval': SEND_INTERVAL}
+    control_task = asyncio.create_task(handle_control_messages(websocket, state))
+    try:
+        while True:
+            async with new_sample:
+                await new_sample.wait_for(lambda: replay_buffer.last_seq >= after_seq + options['batch'])
+            # Everything since the client's position; a throttled client gets it as one batch
+            # per stretched interval, so it is sent less often but nothing is skipped
+            samples, missed = replay_buffer.since(after_seq)
+            await send_samples(websocket, samples, missed, options['format'])
+            for snapshot in samples:
+                latency.record_reading("send", snapshot.data)
+            after_seq = samples[-1].seq
+            client_positions[websocket] = after_seq
+            if state['interval'] > SEND_INTERVAL:
+                await asyncio.sleep(state['interval'])
+    except websockets.ConnectionClosed:
+        pass  # Client went away; it resumes by sequence number when it reconnects
+    finally:
+        control_task.cancel()
+        client_positions.pop(websocket, None)
+
+async def report_stats(backend):
     while True:
-        data = get_sensor_data()
-        await websocket.send(data)
-        await asyncio.sleep(1)  # Send data every second
+        await asyncio.sleep(STATS_INTERVAL)
+        print(f"Latency: {latency.format()}")
+        if LATENCY_METRICS_DIR:
+            latency.write_json(os.path.join(LATENCY_METRICS_DIR, "server-latency.json"))
+        if backend is not None:
+            for name, devices in backend.stats().items():
+                print(f"Bus {name}: " + ", ".join(
+                    f"{address} {s['transfers']} transfers, {s['errors']} errors" for address, s in devices.items()
+                ))
 
-# Start the WebSocket server on localhost:6789
-start_server = websockets.serve(sensor_data, "localhost", 6789)
+async def main():
+    global new_sample
+    new_sample = asyncio.Condition()
+    stop_sampling = threading.Event()
+    if REPLAY_SOURCE:
+        backend = None
+        sampler = threading.Thread(target=replay_loop, args=(asyncio.get_running_loop(), stop_sampling, REPLAY_SOURCE), daemon=True)
+    else:
+        backend = build_backend(SENSOR_BACKEND, SENSOR_BACKEND_CONFIG)
+        backend.open()
+        sampler = threading.Thread(target=sample_loop, args=(asyncio.get_running_loop(), stop_sampling, backend.channels()), daemon=True)
+    sampler.start()
+    stats_task = asyncio.create_task(report_stats(backend))
+    # Start the WebSocket server on localhost (port 6789 unless SENSOR_WEBSOCKET_PORT is set)
+    try:
+        async with websockets.serve(sensor_data, "localhost", WEBSOCKET_PORT):
+            await asyncio.Future()
+    finally:
+        stats_task.cancel()
+        stop_sampling.set()
+        sampler.join()
+        if backend is not None:
+            backend.close()
 
-asyncio.get_event_loop().run_until_complete(start_server)
-asyncio.get_event_loop().run_forever()
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -34,7 +34,7 @@ st.markdown("<h1 class='title'>Real-Time Weather Data Dashboard</h1>", unsafe_al
 if 'df' not in st.session_state:
     st.session_state.df = pd.DataFrame()
     st.session_state.data_fetched = False
-    st.session_state.last_fetch_time = '1970-01-01 00:00:00'
+    st.session_state.last_seq = 0  # Insertion cursor of the last row fetched (see update_df_from_db)
 
 # Get database connection
 conn = get_db_connection()
@@ -0,0 +1,257 @@
+import asyncio
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import websockets
+
+# Configuration
+ACQUISITION_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts', 'data_acquisition.py'))
+WEBSOCKET_PORT = 6790          # Fake sensor server (the real one uses 6789)
+INFLUX_PORT = 8087             # Fake InfluxDB write endpoint (the real one uses 8086)
+DEFAULT_RATE = 100             # Messages per second
+DEFAULT_DURATION = 30          # Seconds of sustained load
+POLL_INTERVAL = 0.05           # Seconds between SQLite polls for newly committed rows
+
+# ---------------------------
+# Fake sensor server
+# ---------------------------
+class FakeSensorServer:
+    def __init__(self, rate, duration):
+        """
+        Websocket producer speaking the sensor server's protocol at a fixed rate.
+
+        :param rate: Messages per second.
+        :param duration: Seconds to produce for once a client has connected.
+        """
+        self.rate = rate
+        self.duration = duration
+        self.stream = int(time.time())
+        self.sent = 0
+        self.first_sent_at = None  # time.time() of the first and last message sent
+        self.last_sent_at = None
+        self.done = threading.Event()
+
+    def make_sample(self):
+        self.sent += 1
+        return {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "temperature": round(random.uniform(15.0, 35.0), 2),
+            "humidity": round(random.uniform(30.0, 90.0), 2),
+            "pressure": round(random.uniform(980.0, 1050.0), 2),
+            "AQI": round(random.uniform(10000.0, 20000.0), 2),
+            "uv_data": round(random.uniform(0.0, 1100.0), 2),
+            "ambient_light": round(random.uniform(100.0, 1000.0), 2),
+            "ts_ms": int(time.time() * 1000),
+            "stream": self.stream,
+            "seq": self.sent,
+        }
+
+    async def handler(self, websocket, path=None):
+        if self.done.is_set():
+            return
+        # Send in 10 ms ticks so high rates don't depend on sleep() resolution
+        tick = 0.01
+        start = time.monotonic()
+        while time.monotonic() - start < self.duration:
+            due = int((time.monotonic() - start) * self.rate) - self.sent
+            for _ in range(due):
+                await websocket.send(json.dumps(self.make_sample()))
+            if due:
+                self.last_sent_at = time.time()
+                if self.first_sent_at is None:
+                    self.first_sent_at = self.last_sent_at
+            await asyncio.sleep(tick)
+        self.done.set()
+        await websocket.wait_closed()
+
+    def serve(self):
+        async def run():
+            async with websockets.serve(self.handler, "localhost", WEBSOCKET_PORT):
+                await asyncio.Future()
+        threading.Thread(target=lambda: asyncio.run(run()), daemon=True).start()
+
+# ---------------------------
+# Fake InfluxDB write endpoint
+# ---------------------------
+class FakeInfluxHandler(BaseHTTPRequestHandler):
+    latency = 0.0          # Seconds added to every write
+    failure_rate = 0.0     # Fraction of writes answered with 503
+    lock = threading.Lock()
+    points = 0
+    failures = 0
+    latencies = []         # Sample time -> arrival, in seconds
+    arrivals = []          # Arrival time of every point
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            with self.lock:
+                FakeInfluxHandler.failures += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        arrived = time.time()
+        lines = [line for line in body.decode('utf-8').splitlines() if line]
+        with self.lock:
+            FakeInfluxHandler.points += len(lines)
+            for line in lines:
+                FakeInfluxHandler.latencies.append(arrived - int(line.rsplit(' ', 1)[1]) / 1e9)
+                FakeInfluxHandler.arrivals.append(arrived)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+# ---------------------------
+# Measurement helpers
+# ---------------------------
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def poll_sqlite(db_path, stop_event, latencies, commit_times):
+    # Records sample time -> visible-in-SQLite latency for every committed row
+    last_seq = 0
+    conn = None
+    while not stop_event.is_set():
+        try:
+            if conn is None:
+                conn = sqlite3.connect(db_path)
+            rows = conn.execute('SELECT seq, ts_ms FROM weather_readings WHERE seq > ? ORDER BY seq', (last_seq,)).fetchall()
+        except sqlite3.Error:
+            rows = []
+        now = time.time()
+        for seq, ts_ms in rows:
+            latencies.append(now - ts_ms / 1000)
+            commit_times.append(now)
+            last_seq = seq
+        time.sleep(POLL_INTERVAL)
+    if conn is not None:
+        conn.close()
+
+def summarize(latencies, arrivals, producer, stopped_at):
+    # Throughput over the sink's own window: from the first message sent until the producer
+    # stopped or, if the sink fell behind, until its last arrival before the daemon was told to
+    # stop. Rows flushed at shutdown are counted but do not stretch the window with idle time.
+    caught_up = [arrived for arrived in arrivals if arrived < stopped_at]
+    window_end = max([producer.last_sent_at] + caught_up[-1:]) if producer.last_sent_at else None
+    elapsed = window_end - producer.first_sent_at if window_end else None
+    return {
+        "messages": len(arrivals),
+        "window_sec": elapsed,
+        "msgs_per_sec": len(arrivals) / elapsed if elapsed else None,
+        "p50_latency_sec": percentile(latencies, 0.50),
+        "p99_latency_sec": percentile(latencies, 0.99),
+        "max_latency_sec": max(latencies) if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest Performance Test (drives scripts/data_acquisition.py against local fakes)")
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help='Messages per second sent by the fake sensor server')
+    parser.add_argument('--duration', type=int, default=DEFAULT_DURATION, help='Seconds of sustained load')
+    parser.add_argument('--sinks', default='sqlite,influx', help='Sinks enabled in the acquisition daemon')
+    parser.add_argument('--influx-latency', type=float, default=0.0, help='Seconds the fake InfluxDB waits before answering a write')
+    parser.add_argument('--influx-failure-rate', type=float, default=0.0, help='Fraction of writes the fake InfluxDB rejects with 503')
+    parser.add_argument('--sinks-config', default=None, help='JSON file with sink option overrides (batch sizes etc.)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ingest_bench_')
+    db_path = os.path.join(workdir, 'weather_data.db')
+
+    # Point the daemon at the fakes and at a scratch database
+    sinks_config = {
+        "sqlite": {"db_path": db_path},
+        "influx": {"url": f"http://localhost:{INFLUX_PORT}", "token": "benchmark", "spool_dir": os.path.join(workdir, 'spool')},
+    }
+    if args.sinks_config:
+        with open(args.sinks_config) as f:
+            for name, options in json.load(f).items():
+                sinks_config.setdefault(name, {}).update(options)
+    sinks_config_path = os.path.join(workdir, 'sinks.json')
+    with open(sinks_config_path, 'w') as f:
+        json.dump(sinks_config, f)
+
+    # Start the fakes
+    FakeInfluxHandler.latency = args.influx_latency
+    FakeInfluxHandler.failure_rate = args.influx_failure_rate
+    influx_server = ThreadingHTTPServer(("localhost", INFLUX_PORT), FakeInfluxHandler)
+    threading.Thread(target=influx_server.serve_forever, daemon=True).start()
+    producer = FakeSensorServer(args.rate, args.duration)
+    producer.serve()
+
+    env = dict(os.environ)
+    env.update({
+        "WEATHER_DB_PATH": db_path,
+        "SENSOR_WEBSOCKET_URL": f"ws://localhost:{WEBSOCKET_PORT}",
+        "ACQUISITION_SINKS": args.sinks,
+        "SINKS_CONFIG": sinks_config_path,
+    })
+
+    sqlite_latencies = []
+    commit_times = []
+    stop_polling = threading.Event()
+    poller = threading.Thread(target=poll_sqlite, args=(db_path, stop_polling, sqlite_latencies, commit_times), daemon=True)
+    poller.start()
+
+    print(f"Running {args.rate} msgs/s for {args.duration}s against sinks: {args.sinks}")
+    daemon = subprocess.Popen([sys.executable, ACQUISITION_SCRIPT], env=env)
+
+    # Wait for the producer to finish, then give the sinks their flush interval to drain
+    producer.done.wait(args.duration + 30)
+    time.sleep(2)
+    stopped_at = time.time()
+    daemon.send_signal(signal.SIGTERM)
+    _, _, rusage = os.wait4(daemon.pid, 0)
+    time.sleep(POLL_INTERVAL * 4)
+    stop_polling.set()
+    poller.join()
+    influx_server.shutdown()
+
+    cpu_sec = rusage.ru_utime + rusage.ru_stime
+
+    metrics = {
+        "config": vars(args),
+        "sent": producer.sent,
+        "daemon_cpu_sec": cpu_sec,
+        "cpu_ms_per_message": cpu_sec * 1000 / producer.sent if producer.sent else None,
+        "max_rss_kb": rusage.ru_maxrss,
+    }
+    if 'sqlite' in args.sinks:
+        metrics["sqlite"] = summarize(sqlite_latencies, commit_times, producer, stopped_at)
+    if 'influx' in args.sinks:
+        metrics["influxdb"] = summarize(FakeInfluxHandler.latencies, FakeInfluxHandler.arrivals, producer, stopped_at)
+        metrics["influxdb"]["rejected_writes"] = FakeInfluxHandler.failures
+
+    print("\nIngest Performance Metrics:")
+    print(f"Sent: {producer.sent} messages, daemon CPU {cpu_sec:.2f}s ({metrics['cpu_ms_per_message']:.3f} ms/message)")
+    for name in ("sqlite", "influxdb"):
+        if name in metrics:
+            m = metrics[name]
+            if m["messages"]:
+                print(f"{name}: {m['messages']} stored, {m['msgs_per_sec']:.1f} msgs/s, "
+                      f"p50 {m['p50_latency_sec']:.3f}s, p99 {m['p99_latency_sec']:.3f}s end-to-end")
+            else:
+                print(f"{name}: nothing stored")
+
+    with open("ingest_performance_metrics.json", "w") as f:
+        json.dump(metrics, f, indent=4)
+
+    print("\nIngest performance metrics saved to ingest_performance_metrics.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from drivers.i2c_bus import I2CBus
+from drivers.i2c_emulation import FakeLTR390, FakeSMBus, RecordingSMBus, ReplaySMBus
+from drivers.DFRobot_LTR390UV import DFRobot_LTR390UV_I2C
+from drivers.ltr390_constants import e18bit, e100ms, eGain3
+
+# Configuration
+LTR390_ADDRESS = 0x1C
+DEFAULT_DURATION = 5           # Seconds per access pattern
+DEFAULT_POLL_INTERVAL = 0.01   # Seconds between reads for the polling patterns
+DEFAULT_BUS_SPEED = 100000     # Emulated bus clock in Hz (the Pi's default)
+PATTERNS = ('poll', 'sample', 'wait', 'alternating')
+
+# ---------------------------
+# Access patterns
+# ---------------------------
+# Each runs one way of reading the sensor for the given time and returns
+# (reads, new samples): reads are driver calls, new samples the ones that
+# carried a conversion not seen before.
+
+def run_poll(sensor, duration, poll_interval):
+    # The original driver call: reads the data registers whether or not a conversion finished
+    reads, samples, last = 0, 0, None
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        data = sensor.read_original_data()
+        reads += 1
+        if data != last:
+            samples += 1
+            last = data
+        time.sleep(poll_interval)
+    return reads, samples
+
+def run_sample(sensor, duration, poll_interval):
+    # Burst read with freshness, at the same poll rate
+    reads, samples = 0, 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        data, fresh = sensor.read_sample()
+        reads += 1
+        samples += fresh
+        time.sleep(poll_interval)
+    return reads, samples
+
+def run_wait(sensor, duration, poll_interval):
+    # Sleep until each conversion, then read it once
+    reads = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        sensor.wait_for_next_conversion()
+        reads += 1
+    return reads, reads
+
+def run_alternating(sensor, duration, poll_interval):
+    # UVS and ALS in turn, one switch per finished conversion
+    reads, samples = 0, 0
+    sensor.begin_alternating()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        samples += sensor.update_alternating() is not None
+        reads += 1
+        time.sleep(poll_interval)
+    sensor.set_mode(0x0A)
+    return reads, samples
+
+RUNNERS = {'poll': run_poll, 'sample': run_sample, 'wait': run_wait, 'alternating': run_alternating}
+
+# ---------------------------
+# Measurement helpers
+# ---------------------------
+class TimedSMBus:
+    def __init__(self, smbus):
+        """
+        Times every transfer of the wrapped handle.
+
+        :param smbus: SMBus-like handle.
+        """
+        self.smbus = smbus
+        self.durations = []
+
+    def __getattr__(self, op):
+        call = getattr(self.smbus, op)
+        if op == 'close':
+            return call
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return call(*args)
+            finally:
+                self.durations.append(time.perf_counter() - start)
+        return timed
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def open_bus(args):
+    # Emulated sensor by default; real bus on a Pi with --hardware; a recording with --replay
+    device = None
+    if args.replay:
+        smbus = ReplaySMBus(args.replay)
+    elif args.hardware:
+        from Adafruit_PureIO.smbus import SMBus
+        smbus = SMBus(args.bus)
+    else:
+        device = FakeLTR390(lux=args.lux, uv_index=args.uv_index, noise=args.noise)
+        smbus = FakeSMBus({LTR390_ADDRESS: device}, bus_speed=args.bus_speed)
+    if args.record:
+        smbus = RecordingSMBus(smbus)
+    return TimedSMBus(smbus), device
+
+def main():
+    parser = argparse.ArgumentParser(description="LTR390 Driver Benchmark (transfers per sample and latency per read)")
+    parser.add_argument('--patterns', default=','.join(PATTERNS), help=f'Access patterns to run, from {",".join(PATTERNS)}')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='Seconds per pattern')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help='Seconds between reads when polling')
+    parser.add_argument('--bus-speed', type=int, default=DEFAULT_BUS_SPEED, help='Emulated bus clock in Hz (0 for instant transfers)')
+    parser.add_argument('--lux', type=float, default=300.0, help='Emulated ambient light')
+    parser.add_argument('--uv-index', type=float, default=2.0, help='Emulated UV index')
+    parser.add_argument('--noise', type=float, default=0.01, help='Emulated relative noise of the counts')
+    parser.add_argument('--hardware', action='store_true', help='Use the real I2C bus instead of the emulated sensor')
+    parser.add_argument('--bus', type=int, default=1, help='I2C bus number with --hardware')
+    parser.add_argument('--record', default=None, help='Save every transfer to this JSON lines file')
+    parser.add_argument('--replay', default=None, help='Replay transfers recorded with --record instead of using a bus')
+    args = parser.parse_args()
+
+    timed, device = open_bus(args)
+    bus = I2CBus(args.bus, smbus=timed)
+    sensor = DFRobot_LTR390UV_I2C(bus, LTR390_ADDRESS)
+    if not sensor.begin():
+        print("LTR390 not found")
+        return
+    sensor.set_ALS_or_UVS_meas_rate(e18bit, e100ms)
+    sensor.set_ALS_or_UVS_gain(eGain3)
+    sensor.set_mode(0x0A)
+    print(f"Conversion period {sensor.conversion_period() * 1000:.0f} ms, polling every {args.poll_interval * 1000:.0f} ms")
+
+    metrics = {"config": vars(args), "patterns": {}}
+    for pattern in args.patterns.split(','):
+        transfers_before = len(timed.durations)
+        conversions_before = device.conversions if device else None
+        start = time.monotonic()
+        reads, samples = RUNNERS[pattern](sensor, args.duration, args.poll_interval)
+        elapsed = time.monotonic() - start
+        durations = timed.durations[transfers_before:]
+        result = {
+            "reads": reads,
+            "new_samples": samples,
+            "samples_per_sec": samples / elapsed,
+            "transfers": len(durations),
+            "transfers_per_sample": len(durations) / samples if samples else None,
+            "p50_transfer_ms": percentile(durations, 0.50) * 1000 if durations else None,
+            "p99_transfer_ms": percentile(durations, 0.99) * 1000 if durations else None,
+            "bus_busy_fraction": sum(durations) / elapsed,
+        }
+        if device:
+            result["sensor_conversions"] = device.conversions - conversions_before
+        metrics["patterns"][pattern] = result
+        print(f"{pattern}: {reads} reads, {samples} new samples ({result['samples_per_sec']:.1f}/s), "
+              f"{result['transfers']} transfers ({result['transfers_per_sample'] or 0:.1f} per sample), "
+              f"p50 {result['p50_transfer_ms'] or 0:.3f} ms per transfer, bus busy {result['bus_busy_fraction'] * 100:.1f}%")
+
+    if args.record:
+        timed.smbus.save(args.record)
+        print(f"\nRecorded {len(timed.smbus.records)} transfers to {args.record}")
+
+    with open("ltr390_benchmark_metrics.json", "w") as f:
+        json.dump(metrics, f, indent=4)
+
+    print("\nLTR390 benchmark metrics saved to ltr390_benchmark_metrics.json")
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,90 @@
 # utils/data_processing.py
 
+import os
+import time
 import streamlit as st
 import pandas as pd
-import sqlite3
 import numpy as np
+from utils.storage import DB_PATH, connect_reader, get_schema_version
+from utils.latency import LatencyRecorder
+
+LATENCY_METRICS_DIR = os.getenv("LATENCY_METRICS_DIR")  # Write dashboard-latency.json here when set
+LATENCY_WRITE_INTERVAL = 60                             # Seconds between metric file writes
 
 @st.cache_resource
 def get_db_connection():
     """
-    Returns a cached database connection.
+    Returns a cached read-only database connection (WAL reader, never blocks ingest).
     """
-    conn = sqlite3.connect('/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/weather_data.db', check_same_thread=False)
+    conn = connect_reader(DB_PATH, check_same_thread=False)
     return conn
 
+@st.cache_resource
+def get_latency_recorder():
+    """
+    Returns the process-wide recorder of sample-to-dashboard-fetch latency (see utils/latency.py).
+    """
+    return LatencyRecorder()
+
+def record_fetch_latency(ts_ms_values, after_ms):
+    """
+    Records how long after being sampled each newly fetched row reached the dashboard.
+
+    Only rows sampled after the newest row already shown count: older ones (late
+    catch-up rows) would report their age rather than the fetch latency.
+
+    Args:
+        ts_ms_values: Sample times (epoch ms) of the fetched rows.
+        after_ms: Sample time (epoch ms) of the newest row fetched before.
+    """
+    recorder = get_latency_recorder()
+    for ts_ms in ts_ms_values[ts_ms_values > after_ms]:
+        recorder.record_reading('fetch', {'ts_ms': int(ts_ms)})
+    if LATENCY_METRICS_DIR and time.time() - recorder.last_written >= LATENCY_WRITE_INTERVAL:
+        recorder.write_json(os.path.join(LATENCY_METRICS_DIR, "dashboard-latency.json"))
+
 def update_df_from_db(conn):
-    if 'last_fetch_time' not in st.session_state or st.session_state['last_fetch_time'] is None:
-        st.session_state['last_fetch_time'] = '1970-01-01 00:00:00'
+    """
+    Appends rows stored since the last refresh to the session DataFrame.
 
-    query = '''
-        SELECT Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light
+    Rows are fetched by insertion cursor (seq in schema v2, the table rowid in
+    v1) rather than by timestamp, so each refresh only reads new rows, never
+    skips rows that share a second, and needs no duplicate removal.
+    """
+    if st.session_state.get('last_seq') is None:
+        st.session_state['last_seq'] = 0
+
+    schema_version = get_schema_version(conn)
+    cursor_column = 'seq' if schema_version >= 2 else 'rowid'
+    # Schema v2 also exposes the sample time in epoch ms, used for the fetch latency metric
+    ts_ms_column = ', ts_ms' if schema_version >= 2 else ''
+    query = f'''
+        SELECT {cursor_column} AS seq, Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light{ts_ms_column}
         FROM weather_data
-        WHERE Timestamp > ?
+        WHERE {cursor_column} > ?
+        ORDER BY {cursor_column}
     '''
 
-    df_new = pd.read_sql_query(query, conn, params=(st.session_state['last_fetch_time'],))
+    df_new = pd.read_sql_query(query, conn, params=(st.session_state['last_seq'],))
     if not df_new.empty:
+        st.session_state['last_seq'] = int(df_new['seq'].iloc[-1])
+        if 'ts_ms' in df_new:
+            # Incremental fetches only; the first load of a session reads the whole history
+            newest_ms = st.session_state.get('last_ts_ms')
+            if newest_ms is not None:
+                record_fetch_latency(df_new['ts_ms'], newest_ms)
+            st.session_state['last_ts_ms'] = max(int(df_new['ts_ms'].max()), newest_ms or 0)
+            df_new = df_new.drop(columns=['ts_ms'])
+        df_new = df_new.drop(columns=['seq'])
         df_new['Timestamp'] = pd.to_datetime(df_new['Timestamp'])
         if 'df' not in st.session_state or st.session_state.df.empty:
             st.session_state.df = df_new
         else:
-            st.session_state.df = pd.concat([st.session_state.df, df_new]).drop_duplicates().reset_index(drop=True)
-        st.session_state['last_fetch_time'] = df_new['Timestamp'].max().strftime("%Y-%m-%d %H:%M:%S")
+            needs_sort = df_new['Timestamp'].min() < st.session_state.df['Timestamp'].iloc[-1]
+            st.session_state.df = pd.concat([st.session_state.df, df_new], ignore_index=True)
+            if needs_sort:
+                # Late rows (e.g. replayed after a reconnect) go back into time order
+                st.session_state.df = st.session_state.df.sort_values('Timestamp', kind='stable', ignore_index=True)
         st.session_state['data_fetched'] = True
 
 def get_old_data(df, minutes=30):
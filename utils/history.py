@@ -0,0 +1,115 @@
+# utils/history.py
+#
+# Reads recorded readings back in time order, for replaying history through
+# the sensor server (see SENSOR_REPLAY in websocket_server.py). Sources:
+#
+#   *.db, *.sqlite   The station database; weather_readings (schema v2) or
+#                    the v1 weather_data table, read in chunks.
+#   *.csv            Export with a header row; columns named like the
+#                    weather_data table (Timestamp, Temperature, ..., AQI) or
+#                    like the readings (ts_ms, temperature, ...), any case.
+#   *.jsonl          One reading dict per line, as sent by the sensor server.
+#
+# Every reading comes out as a dict keyed like the sensor server's readings
+# with ts_ms set. File sources are expected to be in time order already.
+
+import csv
+import json
+from datetime import datetime
+
+from utils.storage import connect_reader, get_schema_version
+
+READ_CHUNK_ROWS = 5000  # Rows fetched from SQLite at a time
+
+# Lower-cased source column -> reading key
+COLUMN_KEYS = {
+    'ts_ms': 'ts_ms',
+    'timestamp': 'timestamp',
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'pressure': 'pressure',
+    'aqi': 'AQI',
+    'uv_data': 'uv_data',
+    'ambient_light': 'ambient_light',
+}
+VALUE_KEYS = ('temperature', 'humidity', 'pressure', 'AQI', 'uv_data', 'ambient_light')
+
+
+def _timestamp_to_ms(timestamp):
+    return int(datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp() * 1000)
+
+
+def _normalize(row):
+    # Maps source columns to reading keys and makes sure ts_ms is set
+    data = {}
+    for column, value in row.items():
+        key = COLUMN_KEYS.get(column.lower())
+        if key is None or value in (None, ''):
+            continue
+        if key == 'timestamp':
+            data[key] = value
+        elif key == 'ts_ms':
+            data[key] = int(value)
+        else:
+            data[key] = float(value)
+    if 'ts_ms' not in data:
+        data['ts_ms'] = _timestamp_to_ms(data['timestamp'])
+    return data
+
+
+def _iter_sqlite(path):
+    conn = connect_reader(path)
+    try:
+        if get_schema_version(conn) >= 2:
+            query = (
+                'SELECT ts_ms, temperature, humidity, pressure, aqi, uv_data, ambient_light '
+                'FROM weather_readings ORDER BY ts_ms'
+            )
+            columns = ('ts_ms',) + VALUE_KEYS
+        else:
+            # Version 1 table, text timestamps
+            query = (
+                'SELECT Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light '
+                'FROM weather_data ORDER BY Timestamp'
+            )
+            columns = ('timestamp',) + VALUE_KEYS
+        cursor = conn.execute(query)
+        while True:
+            rows = cursor.fetchmany(READ_CHUNK_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                yield _normalize(dict(zip(columns, row)))
+    finally:
+        conn.close()
+
+
+def _iter_csv(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield _normalize(row)
+
+
+def _iter_jsonl(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield _normalize(json.loads(line))
+
+
+def iter_history(path):
+    """
+    Yields recorded readings from a database or exported file, oldest first.
+
+    Args:
+        path: SQLite database (.db/.sqlite), CSV export (.csv) or JSON lines file (.jsonl).
+
+    Returns:
+        Iterator of reading dicts with ts_ms and the sensor fields.
+    """
+    lowered = path.lower()
+    if lowered.endswith('.csv'):
+        return _iter_csv(path)
+    if lowered.endswith('.jsonl'):
+        return _iter_jsonl(path)
+    return _iter_sqlite(path)
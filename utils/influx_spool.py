@@ -0,0 +1,216 @@
+# utils/influx_spool.py
+
+import os
+import threading
+import time
+
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".lp"
+POSITION_SUFFIX = ".pos"
+
+
+class InfluxSpool:
+    def __init__(self, directory, segment_max_bytes=4 * 1024 * 1024):
+        """
+        Append-only on-disk spool for InfluxDB line protocol that could not be written.
+
+        Lines are appended to numbered segment files (spool-0000000001.lp, ...).
+        A segment is closed once it grows past segment_max_bytes and a new one
+        is started, so replay can delete fully drained segments instead of
+        rewriting a single ever-growing file.
+
+        :param directory: Directory holding the segment files, created if missing.
+        :param segment_max_bytes: Size after which the active segment is rotated.
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segment_numbers()
+        self.active_number = (segments[-1] + 1) if segments else 1
+        self.active_file = None
+
+    def _segment_numbers(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        return sorted(numbers)
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:010d}{SEGMENT_SUFFIX}")
+
+    def _rotate(self):
+        if self.active_file is not None:
+            self.active_file.close()
+            self.active_file = None
+            self.active_number += 1
+
+    def append(self, lines):
+        """
+        Appends line protocol lines to the active segment and syncs them to disk.
+
+        :param lines: Iterable of line protocol strings (without trailing newlines).
+        """
+        data = "".join(line + "\n" for line in lines)
+        if not data:
+            return
+        with self.lock:
+            if self.active_file is None:
+                self.active_file = open(self._segment_path(self.active_number), "a", encoding="utf-8")
+            self.active_file.write(data)
+            self.active_file.flush()
+            os.fsync(self.active_file.fileno())
+            if self.active_file.tell() >= self.segment_max_bytes:
+                self._rotate()
+
+    def pending_bytes(self):
+        """
+        Returns the number of bytes still waiting in the spool.
+        """
+        with self.lock:
+            total = 0
+            for number in self._segment_numbers():
+                path = self._segment_path(number)
+                total += os.path.getsize(path) - self._read_position(path)
+            return total
+
+    def oldest_segment(self):
+        """
+        Returns the path of the oldest segment, closing the active one first if it is the only one left.
+
+        :return: Segment path, or None if the spool is empty.
+        """
+        with self.lock:
+            numbers = self._segment_numbers()
+            if not numbers:
+                return None
+            if numbers[0] == self.active_number:
+                # Stop appending to this segment so it can be replayed and removed
+                self._rotate()
+            return self._segment_path(numbers[0])
+
+    def _read_position(self, path):
+        try:
+            with open(path + POSITION_SUFFIX, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def read_batches(self, path, batch_lines):
+        """
+        Yields (lines, end_offset) batches from a segment, starting after the last committed position.
+
+        A trailing line without a newline (left by a crash mid-write) is skipped.
+
+        :param path: Segment path from oldest_segment.
+        :param batch_lines: Maximum number of lines per batch.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(self._read_position(path))
+            batch = []
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break
+                batch.append(line.rstrip("\n"))
+                if len(batch) >= batch_lines:
+                    yield batch, f.tell()
+                    batch = []
+            if batch:
+                yield batch, f.tell()
+
+    def commit(self, path, offset):
+        """
+        Records that a segment has been replayed up to offset.
+
+        :param path: Segment path.
+        :param offset: Byte offset just after the last replayed line.
+        """
+        tmp = path + POSITION_SUFFIX + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path + POSITION_SUFFIX)
+
+    def remove(self, path):
+        """
+        Deletes a fully replayed segment and its position file.
+
+        :param path: Segment path.
+        """
+        with self.lock:
+            for p in (path, path + POSITION_SUFFIX):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+
+class SpoolReplayer:
+    def __init__(self, spool, write_api, bucket, org, batch_lines=5000, max_points_per_sec=2000, retry_interval=30.0):
+        """
+        Drains an InfluxSpool into InfluxDB from a background thread, oldest segment first.
+
+        Each batch is sent as one line protocol write. After a batch the
+        thread sleeps long enough to stay under max_points_per_sec, so a
+        long catch-up does not starve live writes. While InfluxDB is
+        unreachable the replayer waits retry_interval seconds between tries.
+
+        :param spool: InfluxSpool to drain.
+        :param write_api: Synchronous InfluxDB write API.
+        :param bucket: Target bucket.
+        :param org: Target organisation.
+        :param batch_lines: Lines per write call.
+        :param max_points_per_sec: Replay rate cap.
+        :param retry_interval: Seconds to wait after a failed write or when the spool is empty.
+        """
+        self.spool = spool
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.batch_lines = batch_lines
+        self.max_points_per_sec = max_points_per_sec
+        self.retry_interval = retry_interval
+        self.points_replayed = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="influx-spool-replayer", daemon=True)
+        self.thread.start()
+
+    def close(self, timeout=10.0):
+        """
+        Stops the replay thread. Anything not yet replayed stays in the spool.
+        """
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def _replay_segment(self, path):
+        for lines, offset in self.spool.read_batches(path, self.batch_lines):
+            if self.stop_event.is_set():
+                return False
+            start = time.monotonic()
+            self.write_api.write(bucket=self.bucket, org=self.org, record=lines)
+            self.spool.commit(path, offset)
+            self.points_replayed += len(lines)
+            # Rate limit: a batch of n lines may not take less than n / rate seconds
+            min_duration = len(lines) / self.max_points_per_sec
+            self.stop_event.wait(max(0.0, min_duration - (time.monotonic() - start)))
+        return True
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            path = self.spool.oldest_segment()
+            if path is None:
+                self.stop_event.wait(self.retry_interval)
+                continue
+            try:
+                if self._replay_segment(path):
+                    self.spool.remove(path)
+                    print(f"Replayed spool segment {os.path.basename(path)} ({self.points_replayed} points replayed so far)")
+            except Exception as e:
+                print(f"Spool replay paused, InfluxDB write failed: {e}")
+                self.stop_event.wait(self.retry_interval)
@@ -0,0 +1,120 @@
+# utils/ingest.py
+#
+# Lag measurement and backpressure for the acquisition daemon's ingest loop.
+#
+# Lag is the time between a reading being sampled (or, for a replayed
+# reading, sent) by the sensor server and the daemon processing it, measured
+# from its mono_ns stamp as in utils/latency.py so replayed readings that keep
+# their recorded ts_ms do not look hours behind. As soon as one reading lags
+# more than a threshold the ingest loop is "behind" and applies one of these
+# policies until the lag has dropped back under half the threshold:
+#
+#   batch     Batch harder: every sink's batch size and flush interval are
+#             multiplied so each write absorbs more readings. No data is
+#             lost; this is the default.
+#   latest    Drop to latest: readings already queued are discarded and
+#             only the newest one is stored. Keeps storage close to real
+#             time at the cost of gaps; drops are counted.
+#   throttle  Ask the producer to slow down: a {"type": "slow_down"}
+#             control message is sent to the sensor server, which then sends
+#             everything buffered since the last send as one batch per
+#             stretched interval, so there are fewer, larger frames and no
+#             readings are skipped; {"type": "resume"} restores it.
+
+import statistics
+import time
+from collections import deque
+from datetime import datetime
+
+POLICY_BATCH = 'batch'
+POLICY_LATEST = 'latest'
+POLICY_THROTTLE = 'throttle'
+POLICIES = (POLICY_BATCH, POLICY_LATEST, POLICY_THROTTLE)
+
+
+def parse_sample_time(data):
+    """
+    Returns the sample time of a reading as epoch seconds.
+
+    Args:
+        data: Reading dict from the sensor server: 'mono_ns' (the server's monotonic publish
+            time) if present, otherwise 'ts_ms' (epoch milliseconds), otherwise 'timestamp'
+            (local time, "%Y-%m-%d %H:%M:%S").
+
+    Returns:
+        Epoch seconds, or None if the reading has no usable timestamp.
+    """
+    if data.get('mono_ns') is not None:
+        # Same clock on the Pi whatever ts_ms says (replay may keep recorded times); a stamp
+        # from the future comes from another machine's clock, so fall back to ts_ms
+        age = (time.monotonic_ns() - data['mono_ns']) / 1e9
+        if age >= 0:
+            return time.time() - age
+    if data.get('ts_ms') is not None:
+        return data['ts_ms'] / 1000
+    try:
+        return datetime.strptime(data['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class LagTracker:
+    def __init__(self, threshold=5.0, window=300):
+        """
+        Tracks how far ingest lags behind sample time and decides when it is behind.
+
+        Uses hysteresis: the tracker goes behind when a reading lags more than
+        threshold seconds and only recovers once the lag is under half of it,
+        so the policy does not flap on a single slow write.
+
+        :param threshold: Lag in seconds at which ingest counts as behind.
+        :param window: Number of recent lag samples kept for percentiles.
+        """
+        self.threshold = threshold
+        self.samples = deque(maxlen=window)
+        self.behind = False
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.messages = 0
+        self.dropped = 0
+
+    def record(self, sample_time, now=None):
+        """
+        Records the lag of one processed reading.
+
+        :param sample_time: Epoch seconds the reading was sampled at (None to skip).
+        :param now: Processing time, defaults to time.time().
+        :return: 'behind' or 'recovered' if the state changed, otherwise None.
+        """
+        self.messages += 1
+        if sample_time is None:
+            return None
+        lag = max(0.0, (now if now is not None else time.time()) - sample_time)
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.samples.append(lag)
+        if not self.behind and lag > self.threshold:
+            self.behind = True
+            return 'behind'
+        if self.behind and lag < self.threshold / 2:
+            self.behind = False
+            return 'recovered'
+        return None
+
+    def stats(self):
+        """
+        Returns lag statistics over the recent window.
+
+        :return: Dict with last, p50, p99 and max lag in seconds plus message and drop counts.
+        """
+        samples = sorted(self.samples)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else 0.0
+        return {
+            "behind": self.behind,
+            "last_lag_sec": self.last_lag,
+            "p50_lag_sec": statistics.median(samples) if samples else 0.0,
+            "p99_lag_sec": p99,
+            "max_lag_sec": self.max_lag,
+            "messages": self.messages,
+            "dropped": self.dropped,
+        }
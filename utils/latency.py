@@ -0,0 +1,109 @@
+# utils/latency.py
+#
+# Per-stage latency of readings through the pipeline. Every reading carries
+# mono_ns, the time.monotonic_ns() at which the sensor server took it (or, for
+# a decimated snapshot, published it), next to its sequence number. Each stage
+# records how long after that it handled the reading:
+#
+#   send            the sensor server sent the reading to a client
+#   receive         the acquisition daemon decoded it
+#   commit.<sink>   a sink committed it (commit.sqlite, commit.influx, ...)
+#   fetch           a dashboard fetched it from SQLite
+#
+# CLOCK_MONOTONIC is system-wide on Linux, so stamps taken by different
+# processes on the Pi compare directly and are not affected by clock steps.
+# Readings without mono_ns (older servers, rows read back from storage) fall
+# back to the wall-clock ts_ms, at millisecond resolution.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class LatencyRecorder:
+    def __init__(self, window=1000):
+        """
+        Keeps recent latency samples per stage and summarises them.
+
+        Thread-safe, so sink worker threads and the event loop can share one.
+
+        :param window: Number of recent samples kept per stage for percentiles.
+        """
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.max_latency = {}
+        self.last_written = 0.0  # time.time() of the last write_json
+        self.lock = threading.Lock()
+
+    def record(self, stage, latency):
+        """
+        Records one latency sample.
+
+        :param stage: Stage name, e.g. 'receive'.
+        :param latency: Seconds since the reading was sampled.
+        """
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+                self.max_latency[stage] = 0.0
+            self.samples[stage].append(latency)
+            self.counts[stage] += 1
+            self.max_latency[stage] = max(self.max_latency[stage], latency)
+
+    def record_reading(self, stage, data):
+        """
+        Records how long after its sample time a reading reached this stage.
+
+        :param stage: Stage name.
+        :param data: Reading dict with mono_ns and/or ts_ms.
+        """
+        latency = None
+        if data.get('mono_ns') is not None:
+            latency = (time.monotonic_ns() - data['mono_ns']) / 1e9
+        if (latency is None or latency < 0) and data.get('ts_ms') is not None:
+            latency = time.time() - data['ts_ms'] / 1000
+        if latency is not None:
+            self.record(stage, max(0.0, latency))
+
+    def stats(self):
+        """
+        Returns per-stage latency statistics.
+
+        :return: Dict of stage -> count, p50, p99 and max latency in seconds.
+        """
+        with self.lock:
+            result = {}
+            for stage, samples in self.samples.items():
+                ordered = sorted(samples)
+                result[stage] = {
+                    "count": self.counts[stage],
+                    "p50_sec": ordered[len(ordered) // 2] if ordered else 0.0,
+                    "p99_sec": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0,
+                    "max_sec": self.max_latency[stage],
+                }
+            return result
+
+    def format(self):
+        """
+        Returns the statistics as one log line.
+        """
+        return ", ".join(
+            f"{stage} p50 {s['p50_sec'] * 1000:.1f}ms p99 {s['p99_sec'] * 1000:.1f}ms max {s['max_sec'] * 1000:.1f}ms ({s['count']})"
+            for stage, s in sorted(self.stats().items())
+        )
+
+    def write_json(self, path):
+        """
+        Writes the statistics to a JSON file, replacing it atomically.
+
+        :param path: Output file.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"updated": time.time(), "stages": self.stats()}, f, indent=4)
+        os.replace(tmp_path, path)
+        self.last_written = time.time()
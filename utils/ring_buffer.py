@@ -0,0 +1,59 @@
+# utils/ring_buffer.py
+
+import threading
+
+
+class SampleRingBuffer:
+    def __init__(self, capacity=3600):
+        """
+        Fixed-size, array-backed buffer of recent samples keyed by sequence number.
+
+        Sequence numbers start at 1 and increase by one per sample, so the
+        slot of a sample is simply seq % capacity and looking up everything
+        after a given sequence needs no search.
+
+        :param capacity: Number of samples kept (3600 is one hour at 1 Hz).
+        """
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.next_seq = 1
+        self.lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the newest sample (0 if empty).
+        """
+        return self.next_seq - 1
+
+    @property
+    def oldest_seq(self):
+        """
+        Sequence number of the oldest sample still held.
+        """
+        return max(1, self.next_seq - self.capacity)
+
+    def append(self, item):
+        """
+        Stores a sample, overwriting the oldest one once the buffer is full.
+
+        :param item: Sample to store.
+        :return: The sample's sequence number.
+        """
+        with self.lock:
+            seq = self.next_seq
+            self.items[seq % self.capacity] = item
+            self.next_seq = seq + 1
+            return seq
+
+    def since(self, after_seq):
+        """
+        Returns the samples newer than after_seq that are still buffered, oldest first.
+
+        :param after_seq: Last sequence number the caller already has (0 for everything).
+        :return: (samples, missed) where missed counts samples that were already overwritten.
+        """
+        with self.lock:
+            start = max(after_seq + 1, self.oldest_seq)
+            missed = max(0, start - (after_seq + 1))
+            return [self.items[seq % self.capacity] for seq in range(start, self.next_seq)], missed
@@ -0,0 +1,315 @@
+# utils/sensor_backends.py
+#
+# Sensor backends for the websocket server. A backend opens its devices and
+# describes them as channels: (name, device, period in seconds, read), where
+# read() returns a dict of reading fields. The server schedules the channels
+# (channels of one device are read in order, different devices in parallel)
+# and never touches hardware itself.
+#
+#   i2c        BME680, LTR390 and BH1750 on the Pi's I2C bus, all through one
+#              bus manager (drivers/i2c_bus.py). Hardware libraries are only
+#              imported when the backend is opened.
+#   simulated  Deterministic stand-in for the same channels: diurnal curves
+#              plus seeded noise, any sample rate, optional conversion delay
+#              and injected I2C faults. Runs on any machine.
+#
+# Channels are oversampled: the server decimates them to one snapshot per
+# publish interval (mean, min, max and count per field), so a channel's rate
+# is limited by what its sensor allows, not by the output rate. Every backend
+# takes a rates dict (channel name -> reads per second) to override them.
+#
+# Backends are selected and configured by name (see BACKEND_TYPES and
+# build_backend), like the storage sinks in utils/sinks.py.
+
+import errno
+import math
+import random
+import time
+
+LTR390_LUX_MAX_AGE = 2.0  # Oldest cached LTR390 lux (seconds) used when the BH1750 read fails
+BME680_HEATER = (320, 150)  # Gas heater temperature (deg C) and duration (ms), the driver's defaults
+
+
+def with_rates(channels, rates):
+    """
+    Applies per-channel rate overrides.
+
+    Args:
+        channels: (name, device, period, read) tuples.
+        rates: Dict of channel name -> reads per second, or None.
+
+    Returns:
+        Channels with the overridden periods.
+    """
+    rates = rates or {}
+    return [(name, device, 1.0 / rates[name] if name in rates else period, read) for name, device, period, read in channels]
+
+
+class SensorBackend:
+    """
+    Base class for sensor backends.
+    """
+    name = 'backend'
+
+    def open(self):
+        pass
+
+    def channels(self):
+        """
+        Returns the backend's channels as (name, device, period, read) tuples.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self):
+        """
+        Returns backend health counters for the server's periodic report (empty by default).
+        """
+        return {}
+
+
+class I2CSensorBackend(SensorBackend):
+    name = 'i2c'
+
+    def __init__(self, bus=1, bme680_address=0x77, ltr390_address=0x1C, bh1750_address=0x23, rates=None, ltr390_alternating=0):
+        """
+        The station's sensors on the Pi's I2C bus.
+
+        :param bus: I2C bus number shared by all three sensors.
+        :param bme680_address: BME680 address (temperature, humidity, pressure, gas).
+        :param ltr390_address: LTR390 address (UV).
+        :param bh1750_address: BH1750 address (ambient light).
+        :param rates: Channel name -> reads per second, overriding the defaults below.
+        :param ltr390_alternating: UV conversions per ambient light conversion on the LTR390 (0 keeps
+            it in UV mode). Its cached lux then stands in for the BH1750 when that read fails.
+        """
+        self.bus = bus
+        self.bme680_address = bme680_address
+        self.ltr390_address = ltr390_address
+        self.bh1750_address = bh1750_address
+        self.rates = rates
+        self.ltr390_alternating = ltr390_alternating
+        self.bme680 = None
+        self.ltr390 = None
+        self.bh1750 = None
+        self.i2c_bus = None
+        self.last_environment = None
+
+    def open(self):
+        import adafruit_bme680
+        import adafruit_bh1750
+        from drivers.i2c_bus import BusIO, get_bus
+        from drivers.DFRobot_LTR390UV import DFRobot_LTR390UV_I2C
+        from drivers.ltr390_constants import e18bit, e100ms, eGain3
+
+        # One bus manager for every sensor (see drivers/i2c_bus.py): the Adafruit drivers get a
+        # busio-compatible view of it, the LTR390 driver uses its register calls directly
+        self.i2c_bus = get_bus(self.bus)
+        i2c = BusIO(self.i2c_bus)
+
+        # Initialize BME680 for temperature, humidity, pressure, AQI
+        self.bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c, address=self.bme680_address)
+        # The driver fires the gas heater on every forced measurement; keep it off for the
+        # 10 Hz T/H/P reads and only switch it on around the gas read
+        self.bme680.set_gas_heater(None, None)
+
+        # Initialize LTR390 for UV sensing
+        self.ltr390 = DFRobot_LTR390UV_I2C(self.i2c_bus, self.ltr390_address)
+        if not self.ltr390.begin():
+            print("Failed to initialize LTR390UV sensor")
+        else:
+            print("LTR390UV sensor initialized successfully")
+        self.ltr390.set_ALS_or_UVS_meas_rate(e18bit, e100ms)  # 18-bit resolution and 100ms sampling
+        self.ltr390.set_ALS_or_UVS_gain(eGain3)  # Set gain to 3 (default)
+        if self.ltr390_alternating:
+            self.ltr390.begin_alternating(self.ltr390_alternating)  # UVS and ALS in turn
+        else:
+            self.ltr390.set_mode(0x0A)  # UVS mode as per the library
+
+        # Initialize BH1750 for ambient light sensing
+        self.bh1750 = adafruit_bh1750.BH1750(i2c, address=self.bh1750_address)
+
+    def read_environment(self):
+        # BME680 temperature, humidity and pressure. The driver hands out its cached measurement
+        # until 0.1 s after the last one finished, which a read started every 0.1 s would mostly
+        # get; force a new conversion, which the three properties then share. A read that still
+        # repeats the previous values adds nothing rather than counting twice
+        self.bme680._last_reading = 0
+        data = {
+            "temperature": self.bme680.temperature,
+            "humidity": self.bme680.humidity,
+            "pressure": self.bme680.pressure
+        }
+        if data == self.last_environment:
+            return {}
+        self.last_environment = data
+        return data
+
+    def read_gas(self):
+        # BME680 gas resistance (AQI); slow because of the heater cycle. The driver caches a
+        # measurement for its refresh period, so force a new one with the heater on
+        self.bme680.set_gas_heater(*BME680_HEATER)
+        try:
+            self.bme680._last_reading = 0
+            return {"AQI": self.bme680.gas}
+        finally:
+            self.bme680.set_gas_heater(None, None)
+
+    def read_uv(self):
+        # LTR390 sensor readings (UVS Data). The module has no data-ready flag: one burst reads the
+        # ALS and UVS data registers, and whether a new conversion finished is inferred from the
+        # conversion timing (or a changed value). A read that found none adds nothing rather than
+        # repeating the last sample
+        if self.ltr390_alternating:
+            # A finished conversion switches the sensor to the next mode; only new UV data is sent
+            if self.ltr390.update_alternating() != 0x0A:  # UVS mode
+                return {}
+            return {"uv_data": self.ltr390.read_cached()["uvs"]}
+        data, fresh = self.ltr390.read_sample()
+        return {"uv_data": data} if fresh else {}
+
+    def read_light(self):
+        # BH1750 sensor readings (ambient light in lux)
+        try:
+            return {"ambient_light": self.bh1750.lux}
+        except OSError:
+            # Second lux source: the LTR390's last ALS conversion, if it is recent
+            cached = self.ltr390.read_cached() if self.ltr390_alternating else {}
+            if cached.get("als_age", float("inf")) > LTR390_LUX_MAX_AGE:
+                raise
+            return {"ambient_light": cached["lux"]}
+
+    def close(self):
+        if self.i2c_bus is not None:
+            self.i2c_bus.close()
+
+    def stats(self):
+        # Transfers and errors per device address on the shared bus
+        return {"i2c": self.i2c_bus.stats()} if self.i2c_bus is not None else {}
+
+    def channels(self):
+        return with_rates([
+            ("environment", "bme680", 0.1, self.read_environment),  # T/H/P at 10 Hz, one forced conversion per read (heater off)
+            ("gas", "bme680", 10.0, self.read_gas),                 # Gas every 10 s, the only heated conversion
+            ("uv", "ltr390", self.ltr390.conversion_period(), self.read_uv),  # UV once per conversion (100 ms)
+            ("light", "bh1750", 0.2, self.read_light),              # Ambient light at 5 Hz (120 ms conversions)
+        ], self.rates)
+
+
+class SimulatedSensorBackend(SensorBackend):
+    name = 'simulated'
+
+    def __init__(self, seed=0, rate=None, rates=None, time_scale=1.0, start_time=None, noise=1.0, fault_rate=0.0, read_delay=0.0):
+        """
+        Deterministic simulation of the station's sensors.
+
+        Values follow a day at the simulated time: temperature peaks mid
+        afternoon, humidity mirrors it, pressure has a small twice-daily tide,
+        and UV and light follow the sun between 06:00 and 18:00. Each channel
+        has its own seeded noise source, so a given seed reproduces the same
+        readings regardless of how reads are interleaved across threads.
+
+        :param seed: Noise seed.
+        :param rate: Reads per second for every channel (None keeps the real sensors' periods).
+        :param rates: Channel name -> reads per second, applied after rate.
+        :param time_scale: Simulated seconds per real second (1440 runs a day per minute).
+        :param start_time: Epoch seconds the simulated clock starts at (defaults to now).
+        :param noise: Noise multiplier (0 for smooth curves).
+        :param fault_rate: Fraction of reads that fail with an I2C remote I/O error.
+        :param read_delay: Seconds each read blocks, standing in for conversion time.
+        """
+        self.seed = seed
+        self.rate = rate
+        self.rates = rates
+        self.time_scale = time_scale
+        self.start_time = start_time
+        self.noise = noise
+        self.fault_rate = fault_rate
+        self.read_delay = read_delay
+        self.rngs = {}
+        self.opened_at = None
+
+    def open(self):
+        self.opened_at = time.monotonic()
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.rngs = {name: random.Random(f"{self.seed}:{name}") for name in ("environment", "gas", "uv", "light")}
+
+    def day_phase(self):
+        # Fraction of the local day at the simulated time, 0.0 at midnight
+        simulated = self.start_time + (time.monotonic() - self.opened_at) * self.time_scale
+        local = time.localtime(simulated)
+        return (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + simulated % 1) / 86400
+
+    def daylight(self, phase):
+        # 0 at night, rising to 1 at noon
+        return max(0.0, math.sin(math.pi * (phase - 0.25) / 0.5)) if 0.25 < phase < 0.75 else 0.0
+
+    def begin_read(self, channel):
+        # Conversion time and injected faults, shared by every channel
+        if self.read_delay:
+            time.sleep(self.read_delay)
+        rng = self.rngs[channel]
+        if self.fault_rate and rng.random() < self.fault_rate:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error (simulated)")
+        return rng
+
+    def read_environment(self):
+        rng = self.begin_read("environment")
+        phase = self.day_phase()
+        warmth = math.sin(2 * math.pi * (phase - 0.375))  # Peaks at 15:00
+        return {
+            "temperature": 22.0 + 6.0 * warmth + rng.gauss(0, 0.1 * self.noise),
+            "humidity": min(100.0, max(0.0, 60.0 - 20.0 * warmth + rng.gauss(0, 0.5 * self.noise))),
+            "pressure": 1010.0 + 1.5 * math.sin(4 * math.pi * phase) + rng.gauss(0, 0.05 * self.noise)
+        }
+
+    def read_gas(self):
+        rng = self.begin_read("gas")
+        phase = self.day_phase()
+        return {"AQI": 15000.0 + 3000.0 * math.sin(2 * math.pi * phase) + rng.gauss(0, 200 * self.noise)}
+
+    def read_uv(self):
+        rng = self.begin_read("uv")
+        raw = 1100 * self.daylight(self.day_phase()) + rng.gauss(0, 5 * self.noise)
+        return {"uv_data": max(0, int(round(raw)))}
+
+    def read_light(self):
+        rng = self.begin_read("light")
+        lux = 5.0 + 20000.0 * self.daylight(self.day_phase()) + rng.gauss(0, 2 * self.noise)
+        return {"ambient_light": max(0.0, lux)}
+
+    def channels(self):
+        channels = [
+            ("environment", "bme680", 0.1, self.read_environment),
+            ("gas", "bme680", 10.0, self.read_gas),
+            ("uv", "ltr390", 0.1, self.read_uv),
+            ("light", "bh1750", 0.2, self.read_light),
+        ]
+        if self.rate:
+            channels = [(name, device, 1.0 / self.rate, read) for name, device, _, read in channels]
+        return with_rates(channels, self.rates)
+
+
+BACKEND_TYPES = {
+    'i2c': I2CSensorBackend,
+    'simulated': SimulatedSensorBackend,
+}
+
+
+def build_backend(name, config=None):
+    """
+    Creates a sensor backend by name.
+
+    Args:
+        name: Key of BACKEND_TYPES.
+        config: Keyword arguments for the backend's constructor.
+
+    Returns:
+        Backend instance, not yet opened.
+    """
+    if name not in BACKEND_TYPES:
+        raise ValueError(f"Unknown sensor backend {name!r}, expected one of {sorted(BACKEND_TYPES)}")
+    return BACKEND_TYPES[name](**(config or {}))
@@ -0,0 +1,556 @@
+# utils/sinks.py
+#
+# Fan-out of readings to independent storage sinks. Every sink gets its own
+# bounded queue and worker thread, with its own batch size, flush interval,
+# retry policy and counters, so a slow sink (InfluxDB restarting, an SD card
+# stalling on fsync) never holds back the others.
+#
+# Sinks are selected and configured by name (see SINK_TYPES and
+# build_pipeline); adding one is a config change in data_acquisition.py.
+# A sink only implements write_batch(readings); readings are shared between
+# sinks and must be treated as read-only.
+
+import collections
+import itertools
+import os
+import queue
+import threading
+import time
+
+from utils.sqlite_writer import INSERT_WEATHER_DATA, INSERT_WEATHER_READINGS, UPDATE_INGEST_CURSOR, row_from_reading
+from utils.storage import DB_PATH, CheckpointScheduler, connect_writer, get_schema_version
+from utils.influx_spool import InfluxSpool, SpoolReplayer
+
+
+class Sink:
+    """
+    Base class for storage sinks.
+
+    open() and close() run on the sink's worker thread, so connections
+    created there belong to that thread.
+    """
+    name = 'sink'
+
+    def open(self):
+        pass
+
+    def write_batch(self, readings):
+        raise NotImplementedError
+
+    def on_failure(self, readings, error):
+        """
+        Called with a batch that still failed after all retries. Returns True if the batch was saved elsewhere.
+        """
+        return False
+
+    def stats(self):
+        """
+        Returns sink-specific counters, added to the worker's stats (none by default).
+        """
+        return {}
+
+    def close(self):
+        pass
+
+
+class SinkWorker:
+    def __init__(self, sink, max_queue=10000, batch_size=100, flush_interval=5.0, max_retries=2, retry_backoff=1.0, latency=None):
+        """
+        Feeds one sink from a bounded queue on its own thread.
+
+        A batch is written once batch_size readings are waiting or
+        flush_interval seconds have passed, whichever comes first. A failed
+        batch is retried max_retries times with exponential backoff starting
+        at retry_backoff seconds, then handed to sink.on_failure. When the
+        queue is full the oldest reading is dropped.
+
+        :param sink: Sink instance.
+        :param max_queue: Maximum readings waiting for this sink.
+        :param batch_size: Readings per write_batch call.
+        :param flush_interval: Maximum seconds a reading waits before being written.
+        :param max_retries: Retries of a failed batch before giving up on it.
+        :param retry_backoff: Seconds before the first retry, doubled each time.
+        :param latency: Optional LatencyRecorder (utils/latency.py); committed readings are
+            recorded under the stage commit.<sink name>.
+        """
+        self.sink = sink
+        self.name = sink.name
+        self.base_batch_size = batch_size
+        self.base_flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.latency = latency
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.saved = 0
+        self.retries = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_batch_latency = 0.0
+        self.max_batch_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+        self.thread.start()
+
+    def put(self, reading):
+        """
+        Queues a reading without blocking. Drops the oldest queued reading if the queue is full.
+        """
+        with self.lock:
+            self.received += 1
+        while True:
+            try:
+                self.queue.put_nowait(reading)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    with self.lock:
+                        self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def set_batch_factor(self, factor):
+        """
+        Scales batch size and flush interval, e.g. to batch harder while ingest is behind.
+        """
+        self.batch_size = self.base_batch_size * factor
+        self.flush_interval = self.base_flush_interval * factor
+
+    def stats(self):
+        """
+        Returns a snapshot of the worker's counters.
+        """
+        with self.lock:
+            stats = {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "received": self.received,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "saved": self.saved,
+                "retries": self.retries,
+                "batches": self.batches,
+                "last_batch_size": self.last_batch_size,
+                "last_batch_latency_sec": self.last_batch_latency,
+                "max_batch_latency_sec": self.max_batch_latency,
+            }
+        stats.update(self.sink.stats())
+        return stats
+
+    def close(self, timeout=30.0):
+        """
+        Stops the worker after it has written everything still queued.
+        """
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def _take_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.stop_event.is_set():
+                # Interval over or shutting down: take whatever is left without waiting
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                continue
+            try:
+                # Wake up regularly so a shutdown is noticed without waiting out the interval
+                batch.append(self.queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                pass
+        return batch
+
+    def _flush(self, batch):
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                self.sink.write_batch(batch)
+            except Exception as e:
+                if attempt < self.max_retries:
+                    with self.lock:
+                        self.retries += 1
+                    # Don't sleep through a shutdown; the last attempt still runs
+                    self.stop_event.wait(delay)
+                    delay *= 2
+                    continue
+                print(f"Sink {self.name}: giving up on {len(batch)} readings: {e}")
+                saved = False
+                try:
+                    saved = self.sink.on_failure(batch, e)
+                except Exception as failure_error:
+                    print(f"Sink {self.name}: failure handler error: {failure_error}")
+                with self.lock:
+                    if saved:
+                        self.saved += len(batch)
+                    else:
+                        self.failed += len(batch)
+                return
+            latency = time.monotonic() - start
+            with self.lock:
+                self.written += len(batch)
+                self.batches += 1
+                self.last_batch_size = len(batch)
+                self.last_batch_latency = latency
+                self.max_batch_latency = max(self.max_batch_latency, latency)
+            if self.latency is not None:
+                for reading in batch:
+                    self.latency.record_reading(f"commit.{self.name}", reading)
+            return
+
+    def _run(self):
+        try:
+            self.sink.open()
+        except Exception as e:
+            print(f"Sink {self.name}: failed to open: {e}")
+            raise
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch:
+                    self._flush(batch)
+                elif self.stop_event.is_set():
+                    return
+        finally:
+            try:
+                self.sink.close()
+            except Exception as e:
+                print(f"Sink {self.name}: error on close: {e}")
+
+
+class SinkPipeline:
+    def __init__(self, workers):
+        """
+        Hands every reading to each sink worker.
+
+        :param workers: List of SinkWorker.
+        """
+        self.workers = workers
+
+    def put(self, reading):
+        for worker in self.workers:
+            worker.put(reading)
+
+    def set_batch_factor(self, factor):
+        for worker in self.workers:
+            worker.set_batch_factor(factor)
+
+    def stats(self):
+        return {worker.name: worker.stats() for worker in self.workers}
+
+    def close(self):
+        # Signal every worker first so they drain in parallel
+        for worker in self.workers:
+            worker.stop_event.set()
+        for worker in self.workers:
+            worker.close()
+
+
+# ---------------------------
+# Sinks
+# ---------------------------
+class SQLiteSink(Sink):
+    name = 'sqlite'
+
+    def __init__(self, db_path=DB_PATH, checkpoint_interval=60.0):
+        """
+        Commits each batch with executemany in one transaction (WAL mode, see utils/storage.py),
+        together with the sequence number of the batch's last reading.
+
+        :param db_path: Path to the SQLite database.
+        :param checkpoint_interval: Seconds between background WAL checkpoints.
+        """
+        self.db_path = db_path
+        self.checkpoint_interval = checkpoint_interval
+        self.conn = None
+        self.checkpointer = None
+
+    def open(self):
+        self.conn = connect_writer(self.db_path)
+        self.schema_version = get_schema_version(self.conn)
+        self.insert_sql = INSERT_WEATHER_READINGS if self.schema_version >= 2 else INSERT_WEATHER_DATA
+        # Checkpoints run in the background instead of inside our commits
+        self.checkpointer = CheckpointScheduler(self.db_path, interval=self.checkpoint_interval)
+
+    def write_batch(self, readings):
+        rows = [row_from_reading(data, self.schema_version) for data in readings]
+        last = readings[-1]
+        # `with conn` commits on success and rolls back if executemany raises
+        with self.conn:
+            self.conn.executemany(self.insert_sql, rows)
+            if last.get('seq') is not None:
+                # Lets a restarted daemon resume right after what is on disk
+                self.conn.execute(UPDATE_INGEST_CURSOR, (last.get('stream'), last['seq']))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+
+
+class InfluxSink(Sink):
+    name = 'influx'
+
+    def __init__(self, url, token, org, bucket, measurement='environment', location='office',
+                 spool_dir=None, spool_segment_bytes=4 * 1024 * 1024,
+                 replay_batch=5000, replay_rate=2000, replay_retry_interval=30.0):
+        """
+        Writes batches of points to InfluxDB. Batches that still fail after
+        the worker's retries are spooled to disk and replayed in the
+        background once the server is back (see utils/influx_spool.py).
+
+        :param url: InfluxDB URL.
+        :param token: API token.
+        :param org: Organisation.
+        :param bucket: Target bucket.
+        :param measurement: Measurement name.
+        :param location: Value of the location tag.
+        :param spool_dir: Spool directory, or None to drop failed batches.
+        :param spool_segment_bytes: Rotate spool segments at this size.
+        :param replay_batch: Line protocol lines per replay write.
+        :param replay_rate: Maximum replayed points per second.
+        :param replay_retry_interval: Seconds between replay attempts while InfluxDB is down.
+        """
+        self.url = url
+        self.token = token
+        self.org = org
+        self.bucket = bucket
+        self.measurement = measurement
+        self.location = location
+        self.spool_dir = spool_dir
+        self.spool_segment_bytes = spool_segment_bytes
+        self.replay_batch = replay_batch
+        self.replay_rate = replay_rate
+        self.replay_retry_interval = replay_retry_interval
+        self.client = None
+        self.spool = None
+        self.replayer = None
+
+    def open(self):
+        from influxdb_client import InfluxDBClient
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
+        self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
+        # Blocking writes are fine here, they run on this sink's worker thread
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        if self.spool_dir:
+            self.spool = InfluxSpool(self.spool_dir, segment_max_bytes=self.spool_segment_bytes)
+            self.replayer = SpoolReplayer(
+                self.spool, self.write_api, self.bucket, self.org,
+                batch_lines=self.replay_batch,
+                max_points_per_sec=self.replay_rate,
+                retry_interval=self.replay_retry_interval
+            )
+
+    # (reading key, field name, type); InfluxDB rejects a field whose type changes, so
+    # integer fields stay integers when a value arrives as a float (means, binary frames)
+    FIELDS = (
+        ('temperature', 'temperature', float),
+        ('humidity', 'humidity', float),
+        ('pressure', 'pressure', float),
+        ('AQI', 'gas_resistance', int),
+        ('uv_data', 'uv_data', int),
+        ('ambient_light', 'ambient_light', float),
+    )
+
+    def to_point(self, data):
+        from influxdb_client import Point, WritePrecision
+
+        # Nanosecond precision keeps spooled line protocol replayable with the default precision
+        point = Point(self.measurement) \
+            .tag("location", self.location) \
+            .time(data['ts_ms'] * 1_000_000, WritePrecision.NS)
+        summary = data.get('summary') or {}
+        for key, field, kind in self.FIELDS:
+            point.field(field, self._typed(data[key], kind))
+            # Decimation summary from the sensor server: min/max/count since the previous reading
+            if key in summary:
+                point.field(f"{field}_min", self._typed(summary[key]['min'], kind))
+                point.field(f"{field}_max", self._typed(summary[key]['max'], kind))
+                point.field(f"{field}_count", int(summary[key]['count']))
+        return point
+
+    @staticmethod
+    def _typed(value, kind):
+        if value is None:
+            return None
+        return int(round(value)) if kind is int else float(value)
+
+    def write_batch(self, readings):
+        points = [self.to_point(data) for data in readings]
+        self.write_api.write(bucket=self.bucket, org=self.org, record=points)
+
+    def on_failure(self, readings, error):
+        if self.spool is None:
+            return False
+        self.spool.append(self.to_point(data).to_line_protocol() for data in readings)
+        return True
+
+    def stats(self):
+        if self.spool is None:
+            return {}
+        return {
+            "spool_backlog_bytes": self.spool.pending_bytes(),
+            "points_replayed": self.replayer.points_replayed if self.replayer is not None else 0,
+        }
+
+    def close(self):
+        if self.replayer is not None:
+            self.replayer.close()
+        if self.client is not None:
+            self.client.close()
+
+
+class ParquetSink(Sink):
+    name = 'parquet'
+
+    # (reading key, column name)
+    FIELDS = (
+        ('temperature', 'temperature'),
+        ('humidity', 'humidity'),
+        ('pressure', 'pressure'),
+        ('AQI', 'aqi'),
+        ('uv_data', 'uv_data'),
+        ('ambient_light', 'ambient_light'),
+    )
+
+    def __init__(self, directory, rotate_seconds=3600, compression='snappy'):
+        """
+        Appends batches as row groups to time-rotated Parquet files, named after the start of their
+        period (weather-YYYYmmdd-HHMMSS.parquet, hourly by default).
+
+        Needs pyarrow, which is only imported when the sink is enabled.
+
+        :param directory: Output directory, created if missing.
+        :param rotate_seconds: Start a new file every this many seconds.
+        :param compression: Parquet compression codec.
+        """
+        self.directory = directory
+        self.rotate_seconds = rotate_seconds
+        self.compression = compression
+        self.writer = None
+        self.file_start = None
+
+    def open(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        columns = [('ts_ms', pa.int64())]
+        for _, column in self.FIELDS:
+            columns.append((column, pa.float64()))
+        # Decimation summary from the sensor server (null when the reading has none)
+        for _, column in self.FIELDS:
+            columns += [(f"{column}_min", pa.float64()), (f"{column}_max", pa.float64()), (f"{column}_count", pa.int64())]
+        self.schema = pa.schema(columns)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _file_start(self, data):
+        # Start of the rotation period a reading belongs to, in epoch seconds
+        return (data['ts_ms'] // 1000) // self.rotate_seconds * self.rotate_seconds
+
+    def _writer_for(self, file_start):
+        if self.writer is not None and file_start == self.file_start:
+            return self.writer
+        if self.writer is not None:
+            self.writer.close()
+        name = time.strftime("weather-%Y%m%d-%H%M%S", time.localtime(file_start))
+        path = os.path.join(self.directory, f"{name}.parquet")
+        if os.path.exists(path):
+            # Never append to a closed file (e.g. after a restart); start a new part
+            path = os.path.join(self.directory, f"{name}-{int(time.time())}.parquet")
+        self.writer = self.pq.ParquetWriter(path, self.schema, compression=self.compression)
+        self.file_start = file_start
+        return self.writer
+
+    def write_batch(self, readings):
+        # A batch can span a rotation boundary; each period's readings go to its own file
+        for file_start, group in itertools.groupby(readings, key=self._file_start):
+            self._write_group(file_start, list(group))
+
+    def _write_group(self, file_start, readings):
+        columns = {'ts_ms': [data['ts_ms'] for data in readings]}
+        for key, column in self.FIELDS:
+            columns[column] = [data[key] for data in readings]
+            summaries = [(data.get('summary') or {}).get(key) for data in readings]
+            columns[f"{column}_min"] = [stats['min'] if stats else None for stats in summaries]
+            columns[f"{column}_max"] = [stats['max'] if stats else None for stats in summaries]
+            columns[f"{column}_count"] = [stats['count'] if stats else None for stats in summaries]
+        table = self.pa.Table.from_pydict(columns, schema=self.schema)
+        self._writer_for(file_start).write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class MemoryRingSink(Sink):
+    name = 'memory'
+
+    def __init__(self, capacity=3600):
+        """
+        Keeps the most recent readings in memory, e.g. for a live view or tests.
+
+        :param capacity: Number of readings kept.
+        """
+        self.ring = collections.deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def write_batch(self, readings):
+        with self.lock:
+            self.ring.extend(readings)
+
+    def latest(self, n=1):
+        """
+        Returns the n most recent readings, oldest first.
+        """
+        with self.lock:
+            return list(self.ring)[-n:]
+
+
+SINK_TYPES = {
+    SQLiteSink.name: SQLiteSink,
+    InfluxSink.name: InfluxSink,
+    ParquetSink.name: ParquetSink,
+    MemoryRingSink.name: MemoryRingSink,
+}
+
+WORKER_OPTIONS = ('max_queue', 'batch_size', 'flush_interval', 'max_retries', 'retry_backoff')
+
+
+def build_pipeline(enabled, config, latency=None):
+    """
+    Creates a SinkPipeline from sink names and per-sink config.
+
+    Args:
+        enabled: Sink names in SINK_TYPES, e.g. ['sqlite', 'influx'].
+        config: Dict of sink name -> options. Worker options (see WORKER_OPTIONS)
+            configure the queue, batching and retries; everything else is passed
+            to the sink's constructor.
+        latency: Optional LatencyRecorder shared by every worker for commit latencies.
+
+    Returns:
+        SinkPipeline with one started worker per sink.
+    """
+    workers = []
+    for name in enabled:
+        if name not in SINK_TYPES:
+            raise ValueError(f"Unknown sink {name!r}, expected one of {sorted(SINK_TYPES)}")
+        options = dict(config.get(name, {}))
+        worker_options = {key: options.pop(key) for key in WORKER_OPTIONS if key in options}
+        workers.append(SinkWorker(SINK_TYPES[name](**options), latency=latency, **worker_options))
+    return SinkPipeline(workers)
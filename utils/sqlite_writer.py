@@ -0,0 +1,40 @@
+# utils/sqlite_writer.py
+
+# Version 1 table, text timestamps
+INSERT_WEATHER_DATA = '''
+    INSERT INTO weather_data (Timestamp, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Version 2 table, indexed by epoch milliseconds
+INSERT_WEATHER_READINGS = '''
+    INSERT INTO weather_readings (ts_ms, temperature, humidity, pressure, aqi, uv_data, ambient_light)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def row_from_reading(data, schema_version=2):
+    """
+    Converts a sensor reading dict into a row tuple for the given schema version.
+
+    Args:
+        data: Reading as received from the websocket server, with 'timestamp' and 'ts_ms' set.
+        schema_version: 1 for weather_data (text timestamp), 2 for weather_readings (epoch ms).
+
+    Returns:
+        Tuple in table column order.
+    """
+    return (
+        data['ts_ms'] if schema_version >= 2 else data['timestamp'],
+        data['temperature'],
+        data['humidity'],
+        data['pressure'],
+        data['AQI'],
+        data['uv_data'],
+        data['ambient_light']
+    )
+
+# Written in the same transaction as the rows it covers
+UPDATE_INGEST_CURSOR = '''
+    INSERT OR REPLACE INTO ingest_cursor (id, stream, seq) VALUES (1, ?, ?)
+'''
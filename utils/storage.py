@@ -0,0 +1,373 @@
+# utils/storage.py
+#
+# Shared SQLite setup for the acquisition daemon (single writer) and the
+# Streamlit dashboard (readers). The database runs in WAL mode so readers
+# see the last committed snapshot without blocking the writer, and the
+# writer never fails with "database is locked" while a page is loading.
+
+import os
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.getenv(
+    'WEATHER_DB_PATH',
+    '/home/jaivir1303/myproject/RaspberryPi-Weather-Station/project/weather_data.db'
+)
+
+BUSY_TIMEOUT_MS = 5000          # How long a connection waits on a lock before giving up
+SYNCHRONOUS = 'NORMAL'          # In WAL mode NORMAL only fsyncs at checkpoints, and stays crash safe
+CHECKPOINT_INTERVAL = 60.0      # Seconds between background checkpoints
+CHECKPOINT_TRUNCATE_EVERY = 60  # Every Nth checkpoint truncates the WAL file back to zero bytes
+
+# Schema version 1 is the original weather_data table: Timestamp TEXT plus
+# one REAL column per reading, with no key or index.
+#
+# Schema version 2: rows carry an insertion-ordered sequence number (the
+# rowid, never reused thanks to AUTOINCREMENT) that readers use as a sync
+# cursor, and an index on integer epoch milliseconds, so time range scans
+# and "latest n" queries walk an index. Several readings may share a
+# millisecond at high sample rates, so ts_ms is not unique; resent readings
+# are filtered by the acquisition daemon using ingest_cursor instead.
+SCHEMA_VERSION = 2
+
+CREATE_WEATHER_READINGS = '''
+    CREATE TABLE IF NOT EXISTS weather_readings (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts_ms INTEGER NOT NULL,
+        temperature REAL,
+        humidity REAL,
+        pressure REAL,
+        aqi REAL,
+        uv_data REAL,
+        ambient_light REAL
+    )
+'''
+
+CREATE_WEATHER_READINGS_TS_INDEX = '''
+    CREATE INDEX IF NOT EXISTS weather_readings_ts_ms ON weather_readings (ts_ms)
+'''
+
+# Last sensor server reading committed by the acquisition daemon (stream id
+# and sequence number), updated in the same transaction as each batch so a
+# restarted daemon resumes exactly after what is on disk.
+CREATE_INGEST_CURSOR = '''
+    CREATE TABLE IF NOT EXISTS ingest_cursor (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        stream INTEGER,
+        seq INTEGER
+    )
+'''
+
+# Compatibility view with the version 1 column names. ts_ms and seq are
+# exposed last so readers can filter on the index and the cursor.
+CREATE_WEATHER_DATA_VIEW = '''
+    CREATE VIEW IF NOT EXISTS weather_data AS
+    SELECT
+        strftime('%Y-%m-%d %H:%M:%S', ts_ms / 1000, 'unixepoch', 'localtime') AS Timestamp,
+        temperature AS Temperature,
+        humidity AS Humidity,
+        pressure AS Pressure,
+        aqi AS AQI,
+        uv_data AS UV_Data,
+        ambient_light AS Ambient_Light,
+        ts_ms,
+        seq
+    FROM weather_readings
+'''
+
+# Version 1 writers (e.g. a daemon started before the migration) keep working through the view
+CREATE_WEATHER_DATA_INSERT_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS weather_data_insert
+    INSTEAD OF INSERT ON weather_data
+    BEGIN
+        INSERT INTO weather_readings (ts_ms, temperature, humidity, pressure, aqi, uv_data, ambient_light)
+        VALUES (
+            COALESCE(NEW.ts_ms, CAST(strftime('%s', NEW.Timestamp, 'utc') AS INTEGER) * 1000),
+            NEW.Temperature, NEW.Humidity, NEW.Pressure, NEW.AQI, NEW.UV_Data, NEW.Ambient_Light
+        );
+    END
+'''
+
+# Local-time text timestamp -> epoch milliseconds, as written by version 1 (time.strftime)
+V1_TIMESTAMP_TO_MS = "CAST(strftime('%s', Timestamp, 'utc') AS INTEGER) * 1000"
+
+MIGRATION_CHUNK_ROWS = 5000     # Rows copied per migration transaction
+MIGRATION_PAUSE = 0.05          # Seconds between chunks so the acquisition writer gets the lock
+
+
+def _apply_pragmas(conn, busy_timeout_ms):
+    conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+    conn.execute(f'PRAGMA synchronous = {SYNCHRONOUS}')
+
+
+def connect_writer(db_path=DB_PATH, busy_timeout_ms=BUSY_TIMEOUT_MS):
+    """
+    Opens the acquisition daemon's write connection and makes sure the schema exists.
+
+    Switches the database to WAL mode (the setting is persistent, so readers
+    opened later inherit it) and turns off automatic checkpoints on this
+    connection, leaving them to CheckpointScheduler so a commit never has to
+    copy the WAL back into the database. A new database gets the current
+    schema; an existing version 1 database is left as is until it is
+    migrated with scripts/migrate_db.py.
+
+    Args:
+        db_path: Path to the SQLite database.
+        busy_timeout_ms: Milliseconds to wait on a lock before raising.
+
+    Returns:
+        sqlite3 connection.
+    """
+    conn = sqlite3.connect(db_path, timeout=busy_timeout_ms / 1000)
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    if mode.lower() != 'wal':
+        print(f"Warning: could not enable WAL mode, journal_mode is {mode}")
+    _apply_pragmas(conn, busy_timeout_ms)
+    conn.execute('PRAGMA wal_autocheckpoint = 0')
+    ensure_schema(conn)
+    return conn
+
+
+def connect_reader(db_path=DB_PATH, busy_timeout_ms=BUSY_TIMEOUT_MS, check_same_thread=False):
+    """
+    Opens a read-only connection for the dashboard.
+
+    Readers in WAL mode never block the writer, and query_only guards
+    against a dashboard page accidentally taking a write lock.
+
+    Args:
+        db_path: Path to the SQLite database.
+        busy_timeout_ms: Milliseconds to wait on a lock before raising.
+        check_same_thread: Passed to sqlite3.connect; Streamlit shares the cached connection across threads.
+
+    Returns:
+        sqlite3 connection.
+    """
+    conn = sqlite3.connect(db_path, timeout=busy_timeout_ms / 1000, check_same_thread=check_same_thread)
+    _apply_pragmas(conn, busy_timeout_ms)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+def get_schema_version(conn):
+    """
+    Returns the schema version of an open database (1 for the original text-timestamp table).
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    return version if version else 1
+
+
+def _object_type(conn, name):
+    row = conn.execute('SELECT type FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _create_current_schema(conn):
+    conn.execute(CREATE_WEATHER_READINGS)
+    conn.execute(CREATE_WEATHER_READINGS_TS_INDEX)
+    conn.execute(CREATE_WEATHER_DATA_VIEW)
+    conn.execute(CREATE_WEATHER_DATA_INSERT_TRIGGER)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+def ensure_schema(conn):
+    """
+    Creates the current schema in an empty database. Existing data tables are
+    not touched; the ingest_cursor table is added to any database.
+
+    Args:
+        conn: Open sqlite3 connection.
+
+    Returns:
+        The schema version of the database.
+    """
+    if _object_type(conn, 'weather_data') is None:
+        _create_current_schema(conn)
+    conn.execute(CREATE_INGEST_CURSOR)
+    conn.commit()
+    return get_schema_version(conn)
+
+
+def read_ingest_cursor(conn):
+    """
+    Returns the (stream, seq) of the last committed sensor server reading.
+
+    Args:
+        conn: Open sqlite3 connection.
+
+    Returns:
+        Tuple (stream, seq), or (None, 0) if nothing has been committed yet.
+    """
+    if _object_type(conn, 'ingest_cursor') is None:
+        return None, 0
+    row = conn.execute('SELECT stream, seq FROM ingest_cursor WHERE id = 1').fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+def read_last_reading(conn):
+    """
+    Returns the sensor fields of the newest stored reading.
+
+    Args:
+        conn: Open sqlite3 connection.
+
+    Returns:
+        Dict keyed like the sensor server's readings (temperature, ..., AQI, ...), or {} if
+        there is no schema v2 table or it is empty.
+    """
+    if _object_type(conn, 'weather_readings') != 'table':
+        return {}
+    row = conn.execute(
+        'SELECT temperature, humidity, pressure, aqi, uv_data, ambient_light '
+        'FROM weather_readings ORDER BY seq DESC LIMIT 1'
+    ).fetchone()
+    if row is None:
+        return {}
+    return dict(zip(('temperature', 'humidity', 'pressure', 'AQI', 'uv_data', 'ambient_light'), row))
+
+
+def migrate_to_v2(conn, chunk_rows=MIGRATION_CHUNK_ROWS, pause=MIGRATION_PAUSE, drop_old=False):
+    """
+    Migrates a version 1 database to the epoch-keyed schema while the acquisition daemon keeps writing.
+
+    Rows are copied from the old table in rowid order, chunk_rows per short
+    IMMEDIATE transaction, with the progress stored in the database so an
+    interrupted migration resumes where it stopped. The final transaction
+    copies the rows that arrived meanwhile, renames the old table to
+    weather_data_v1 and puts the compatibility view (with an INSTEAD OF
+    INSERT trigger) in its place, so a writer that still uses the old
+    column names carries on without a restart.
+
+    Rows whose timestamp cannot be parsed are skipped.
+
+    Args:
+        conn: sqlite3 connection opened with isolation_level=None.
+        chunk_rows: Rows copied per transaction.
+        pause: Seconds to sleep between chunks.
+        drop_old: Drop weather_data_v1 once the migration has committed.
+
+    Returns:
+        Number of rows copied.
+    """
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return 0
+    if _object_type(conn, 'weather_data') is None:
+        _create_current_schema(conn)
+        return 0
+
+    conn.execute(CREATE_WEATHER_READINGS)
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_migration (key TEXT PRIMARY KEY, value INTEGER)')
+    row = conn.execute("SELECT value FROM schema_migration WHERE key = 'v2_last_rowid'").fetchone()
+    last_rowid = row[0] if row else 0
+    copied = 0
+
+    def copy_chunk(limit):
+        nonlocal last_rowid, copied
+        chunk_end = conn.execute(
+            'SELECT MAX(rowid) FROM (SELECT rowid FROM weather_data WHERE rowid > ? ORDER BY rowid LIMIT ?)',
+            (last_rowid, limit)
+        ).fetchone()[0]
+        if chunk_end is None:
+            return 0
+        cursor = conn.execute(f'''
+            INSERT INTO weather_readings (ts_ms, temperature, humidity, pressure, aqi, uv_data, ambient_light)
+            SELECT ts_ms, Temperature, Humidity, Pressure, AQI, UV_Data, Ambient_Light
+            FROM (
+                SELECT {V1_TIMESTAMP_TO_MS} AS ts_ms, * FROM weather_data
+                WHERE rowid > ? AND rowid <= ?
+                ORDER BY rowid
+            )
+            WHERE ts_ms IS NOT NULL
+        ''', (last_rowid, chunk_end))
+        copied += max(cursor.rowcount, 0)
+        last_rowid = chunk_end
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_migration (key, value) VALUES ('v2_last_rowid', ?)",
+            (last_rowid,)
+        )
+        return chunk_end
+
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = copy_chunk(chunk_rows) == 0
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if done:
+            break
+        time.sleep(pause)
+
+    # Switch over in one transaction; the writer waits on busy_timeout meanwhile
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        while copy_chunk(chunk_rows):
+            pass
+        conn.execute('ALTER TABLE weather_data RENAME TO weather_data_v1')
+        _create_current_schema(conn)
+        conn.execute('DROP TABLE schema_migration')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    if drop_old:
+        conn.execute('DROP TABLE weather_data_v1')
+    return copied
+
+
+class CheckpointScheduler:
+    def __init__(self, db_path=DB_PATH, interval=CHECKPOINT_INTERVAL, truncate_every=CHECKPOINT_TRUNCATE_EVERY):
+        """
+        Runs WAL checkpoints on a background thread with its own connection.
+
+        Regular checkpoints are PASSIVE: they copy what they can without
+        waiting on readers or the writer. Every truncate_every-th checkpoint
+        is TRUNCATE, which resets the WAL file so it cannot grow without bound
+        on the SD card; it waits at most the busy timeout and is simply
+        retried next time if a reader is still active.
+
+        :param db_path: Path to the SQLite database.
+        :param interval: Seconds between checkpoints.
+        :param truncate_every: Run a TRUNCATE checkpoint every this many checkpoints.
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self.truncate_every = truncate_every
+        self.checkpoints = 0
+        self.last_result = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="sqlite-checkpoint", daemon=True)
+        self.thread.start()
+
+    def close(self, timeout=10.0):
+        """
+        Stops the scheduler after running a final PASSIVE checkpoint.
+        """
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def _checkpoint(self, conn, mode):
+        # Returns (busy, wal_frames, checkpointed_frames)
+        self.last_result = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        self.checkpoints += 1
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        _apply_pragmas(conn, BUSY_TIMEOUT_MS)
+        try:
+            while not self.stop_event.wait(self.interval):
+                mode = 'PASSIVE'
+                if self.truncate_every and (self.checkpoints + 1) % self.truncate_every == 0:
+                    mode = 'TRUNCATE'
+                try:
+                    self._checkpoint(conn, mode)
+                except sqlite3.Error as e:
+                    print(f"WAL checkpoint ({mode}) failed: {e}")
+            self._checkpoint(conn, 'PASSIVE')
+        except sqlite3.Error as e:
+            print(f"WAL checkpoint failed: {e}")
+        finally:
+            conn.close()
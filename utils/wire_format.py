@@ -0,0 +1,139 @@
+# utils/wire_format.py
+#
+# Binary frames for the sensor websocket, negotiated per connection.
+#
+# A client asks for binary frames with "format": "binary" in its subscribe
+# message; a server that does not know the option keeps sending JSON, so
+# clients must accept both (binary frames arrive as bytes, JSON as text).
+#
+# Frame layout, little-endian:
+#
+#   header   schema id (B), sample count (H), missed samples (I)
+#   sample   seq (Q), stream (I), ts_ms (q),
+#            temperature, humidity, pressure, AQI, uv_data, ambient_light (6 x d),
+#            age of each of those fields in ms at ts_ms (6 x I),
+#            then, from schema 2 on, the decimation summary of the same fields:
+#            min (6 x d), max (6 x d), count (6 x H),
+#            then, from schema 3 on, the monotonic sample time mono_ns (Q, 0 if unknown)
+#
+# A field missing from the reading (e.g. unchanged in a change-only frame) is
+# sent as NaN and decoded as absent, an unknown age as AGE_UNKNOWN and a field
+# without a summary as count 0. The text timestamp is not sent; receivers
+# derive it from ts_ms. Frames of older schemas are still decoded.
+
+import math
+import struct
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+
+SCHEMA_ID = 3
+FIELDS = ('temperature', 'humidity', 'pressure', 'AQI', 'uv_data', 'ambient_light')
+AGE_UNKNOWN = 0xFFFFFFFF
+
+HEADER = struct.Struct('<BHI')
+SAMPLE = struct.Struct('<QIq6d6I6d6d6HQ')
+SAMPLE_LAYOUTS = {
+    1: struct.Struct('<QIq6d6I'),
+    2: struct.Struct('<QIq6d6I6d6d6H'),
+    3: SAMPLE,
+}
+
+
+def encode_sample(data):
+    """
+    Packs one reading into its fixed-size binary record.
+
+    Args:
+        data: Reading dict with 'seq', 'stream' and 'ts_ms' set and optionally 'sample_ts_ms',
+            'summary' and 'mono_ns'.
+
+    Returns:
+        bytes of length SAMPLE.size (current schema).
+    """
+    sample_times = data.get('sample_ts_ms') or {}
+    summary = data.get('summary') or {}
+    values = []
+    ages = []
+    minimums = []
+    maximums = []
+    counts = []
+    for field in FIELDS:
+        value = data.get(field)
+        values.append(math.nan if value is None else float(value))
+        sampled = sample_times.get(field)
+        ages.append(AGE_UNKNOWN if sampled is None else min(max(0, data['ts_ms'] - sampled), AGE_UNKNOWN - 1))
+        stats = summary.get(field)
+        minimums.append(float(stats['min']) if stats else math.nan)
+        maximums.append(float(stats['max']) if stats else math.nan)
+        counts.append(min(stats['count'], 0xFFFF) if stats else 0)
+    return SAMPLE.pack(
+        data['seq'], data['stream'], data['ts_ms'], *values, *ages, *minimums, *maximums, *counts,
+        data.get('mono_ns') or 0
+    )
+
+
+def encode_frame(records, missed=0):
+    """
+    Builds a frame from already packed sample records.
+
+    Args:
+        records: List of records from encode_sample().
+        missed: Samples the server could no longer replay.
+
+    Returns:
+        bytes ready to send as one binary websocket message.
+    """
+    return HEADER.pack(SCHEMA_ID, len(records), missed) + b''.join(records)
+
+
+def decode_frame(frame):
+    """
+    Unpacks a binary frame into reading dicts.
+
+    Args:
+        frame: bytes received from the server.
+
+    Returns:
+        (samples, missed) where samples are dicts shaped like the JSON readings; fields
+        sent as NaN are left out.
+
+    Raises:
+        ValueError: If the schema id is unknown or the frame is truncated.
+    """
+    if len(frame) < HEADER.size:
+        raise ValueError("Binary frame shorter than its header")
+    schema_id, count, missed = HEADER.unpack_from(frame)
+    layout = SAMPLE_LAYOUTS.get(schema_id)
+    if layout is None:
+        raise ValueError(f"Unknown binary frame schema id {schema_id}")
+    if len(frame) != HEADER.size + count * layout.size:
+        raise ValueError(f"Binary frame size does not match its {count} samples")
+    n = len(FIELDS)
+    samples = []
+    for offset in range(HEADER.size, len(frame), layout.size):
+        unpacked = layout.unpack_from(frame, offset)
+        seq, stream, ts_ms = unpacked[:3]
+        values = unpacked[3:3 + n]
+        ages = unpacked[3 + n:3 + 2 * n]
+        data = {'seq': seq, 'stream': stream, 'ts_ms': ts_ms}
+        sample_times = {}
+        for field, value, age in zip(FIELDS, values, ages):
+            if not math.isnan(value):
+                data[field] = value
+            if age != AGE_UNKNOWN:
+                sample_times[field] = ts_ms - age
+        data['sample_ts_ms'] = sample_times
+        if schema_id >= 2:
+            minimums = unpacked[3 + 2 * n:3 + 3 * n]
+            maximums = unpacked[3 + 3 * n:3 + 4 * n]
+            counts = unpacked[3 + 4 * n:3 + 5 * n]
+            data['summary'] = {
+                field: {'min': minimum, 'max': maximum, 'count': field_count}
+                for field, minimum, maximum, field_count in zip(FIELDS, minimums, maximums, counts)
+                if field_count
+            }
+        if schema_id >= 3 and unpacked[3 + 5 * n]:
+            data['mono_ns'] = unpacked[3 + 5 * n]
+        samples.append(data)
+    return samples, missed